@@ -0,0 +1,108 @@
+"""Big-integer backend for the cryptosystem.
+
+gmpy2 is used when it is installed; otherwise everything falls back to
+Python's builtin integers. The choice is made once, at import time, and
+all functions return builtin integers either way."""
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+def _python_invert(a, m):
+    m0 = m
+    x0, x1 = 0, 1
+    if m == 1:
+        return 1
+    while a > 1:
+        q = a / m
+        a, m = m, a % m
+        x0, x1 = x1 - q * x0, x0
+    if x1 < 0:
+        x1 += m0
+    return x1
+
+
+def _python_gcd(a, b):
+    while b > 0:
+        a, b = b, a % b
+    return a
+
+
+if gmpy2 is not None:
+    BACKEND = 'gmpy2'
+
+    mpz = gmpy2.mpz
+
+    def to_int(x):
+        return long(x)
+
+    def powmod(base, exponent, modulus):
+        return long(gmpy2.powmod(base, exponent, modulus))
+
+    def invert(a, m):
+        if m == 1:
+            return 1
+        return long(gmpy2.invert(a, m))
+
+    def gcd(a, b):
+        return long(gmpy2.gcd(a, b))
+else:
+    BACKEND = 'python'
+
+    mpz = long
+
+    to_int = long
+
+    powmod = pow
+
+    invert = _python_invert
+
+    gcd = _python_gcd
+
+
+class MultiExpTable(object):
+    """Per-base window tables for Straus' simultaneous exponentiation:
+         prod_i bases[i] ^ exponents[i] mod modulus
+       is computed with one shared chain of squarings. The tables depend
+       only on the bases, so one instance can serve many exponent
+       vectors."""
+    def __init__(self, bases, modulus, window=4):
+        self.modulus = modulus
+        self.window = window
+        self.tables = []
+        for base in bases:
+            base = mpz(base) % modulus
+            table = [mpz(1), base]
+            for _ in range(2, 1 << window):
+                table.append((table[-1] * base) % modulus)
+            self.tables.append(table)
+
+    def pow(self, exponents):
+        assert len(exponents) == len(self.tables)
+        window = self.window
+        digit_mask = (1 << window) - 1
+        total_digits = (max([e.bit_length() for e in exponents] + [0]) +
+                        window - 1) / window
+        digits = []
+        for e in exponents:
+            assert e >= 0
+            digits.append([(e >> (window * i)) & digit_mask
+                           for i in range(total_digits)])
+
+        modulus = self.modulus
+        result = mpz(1)
+        for position in reversed(range(total_digits)):
+            if position != total_digits - 1:
+                for _ in range(window):
+                    result = (result * result) % modulus
+            for i, table in enumerate(self.tables):
+                digit = digits[i][position]
+                if digit != 0:
+                    result = (result * table[digit]) % modulus
+        return to_int(result % modulus)
+
+
+def multi_powmod(bases, exponents, modulus, window=4):
+    return MultiExpTable(bases, modulus, window).pow(exponents)
@@ -0,0 +1,270 @@
+"""Bandwidth accounting for the client/server boundary.
+
+MeteredServer wraps a storage server (onion_oram.Server, a storage engine
+or a remote.RemoteServer) and is passed to a server wrapper in its place:
+
+    metered = MeteredServer(Server(total_levels, blocks_per_bucket,
+                                   chunks_per_block))
+    server_wrapper = EncServerWrapper(..., server=metered)
+
+Every call is sized as remote.RemoteServer would send it: the frame
+header, the operation code and the encoded arguments one way, the frame
+header, the status byte and the encoded result the other. Behind a
+ServerDaemon, the totals are exactly the bytes on the socket.
+
+The bytes of a call are also attributed to the levels of the buckets it
+touches: a call on one bucket to its level, and the rows, selectors and
+candidates of a call on a path to the level of their bucket. Headers, and
+the selected ciphertexts returned by select_rows(), which are not tied to
+a level, are counted as shared.
+
+measure_accesses() runs client accesses and records the bytes of every
+one of them, including the evictions it triggers; report() turns the
+counters into per-access and amortized per-block figures, and the
+ciphertext expansion of every level."""
+
+import instrumentation
+import remote
+import storage
+
+# request and response headers: the frame length and the operation code or
+# status byte
+HEADER_BYTES = 5
+
+# the level that bytes not tied to a bucket are counted under
+SHARED = None
+
+
+def _vector_width(values):
+    """Bytes per element of values encoded as a vector."""
+    return max(remote._int_bytes(x) for x in values)
+
+
+class MeteredServer(object):
+    def __init__(self, server):
+        self.server = server
+        # server method -> [calls, bytes sent, bytes received]
+        self.calls = {}
+        # level, or SHARED -> [bytes sent, bytes received]
+        self.levels = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def __getattr__(self, name):
+        # geometry and anything else that does not cross the boundary
+        return getattr(self.server, name)
+
+    def reset(self):
+        self.calls = {}
+        self.levels = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _add_level(self, level, sent, received):
+        entry = self.levels.setdefault(level, [0, 0])
+        entry[0] += sent
+        entry[1] += received
+
+    def _record(self, name, args, result, sent_parts=(), received_parts=(),
+                bucket_id=None):
+        """Counts one call of name with the given wire arguments. If
+           bucket_id is given, the whole call is attributed to its level;
+           otherwise the (bucket_id, bytes) parts in each direction are,
+           and the rest of the call is shared."""
+        sent = HEADER_BYTES + len(remote.encode(list(args)))
+        received = HEADER_BYTES + len(remote.encode(result))
+        entry = self.calls.setdefault(name, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += sent
+        entry[2] += received
+        self.bytes_sent += sent
+        self.bytes_received += received
+        if instrumentation.active is not None:
+            instrumentation.active.add_call(name, sent, received)
+
+        if bucket_id is not None:
+            self._add_level(storage.bucket_level(bucket_id), sent, received)
+            return
+        for part_bucket, size in sent_parts:
+            self._add_level(storage.bucket_level(part_bucket), size, 0)
+            sent -= size
+        for part_bucket, size in received_parts:
+            self._add_level(storage.bucket_level(part_bucket), 0, size)
+            received -= size
+        self._add_level(SHARED, sent, received)
+
+    @staticmethod
+    def _row_parts(bucket_ids, rows):
+        return [(bucket_id, len(remote.encode(row)))
+                for bucket_id, row in zip(bucket_ids, rows)]
+
+    def get_addresses(self, target):
+        buckets, addresses = self.server.get_addresses(target)
+        self._record('get_addresses', [target], (buckets, addresses),
+                     received_parts=self._row_parts(buckets, addresses))
+        return buckets, addresses
+
+    def get_bucket_addresses(self, bucket_ids):
+        addresses = self.server.get_bucket_addresses(bucket_ids)
+        self._record('get_bucket_addresses', [bucket_ids], addresses,
+                     received_parts=self._row_parts(bucket_ids, addresses))
+        return addresses
+
+    def set_addresses(self, buckets, addresses):
+        self.server.set_addresses(buckets, addresses)
+        self._record('set_addresses', [buckets, addresses], None,
+                     sent_parts=self._row_parts(buckets, addresses))
+
+    def dummy_map(self, bucket_ids):
+        dummies = self.server.dummy_map(bucket_ids)
+        self._record('dummy_map', [bucket_ids], dummies,
+                     received_parts=self._row_parts(bucket_ids, dummies))
+        return dummies
+
+    def get_bucket_metadata(self, bucket_ids):
+        metadata = self.server.get_bucket_metadata(bucket_ids)
+        self._record('get_bucket_metadata', [bucket_ids], metadata,
+                     received_parts=self._row_parts(bucket_ids, metadata))
+        return metadata
+
+    def select_rows(self, public_key, plaintext_space, requests,
+                    executor=None, workers=None):
+        selected = self.server.select_rows(public_key, plaintext_space,
+                                           requests, executor, workers)
+        # a candidate costs its selector, its (bucket_id, block_id) pair and
+        # its space, each at the width of the vector it is sent in
+        parts = []
+        for selectors, candidates, spaces in requests:
+            if len(candidates) == 0:
+                continue
+            selector_width = _vector_width(selectors)
+            space_width = _vector_width(spaces)
+            for candidate in candidates:
+                parts.append((candidate[0], selector_width + space_width +
+                              len(remote.encode(candidate))))
+        self._record('select_rows', [public_key.n, public_key.s,
+                                     plaintext_space, requests],
+                     selected, sent_parts=parts)
+        return selected
+
+    def is_dummy(self, bucket_id, block_id):
+        result = self.server.is_dummy(bucket_id, block_id)
+        self._record('is_dummy', [bucket_id, block_id], result,
+                     bucket_id=bucket_id)
+        return result
+
+    def get_metadata(self, bucket_id, block_id):
+        result = self.server.get_metadata(bucket_id, block_id)
+        self._record('get_metadata', [bucket_id, block_id], result,
+                     bucket_id=bucket_id)
+        return result
+
+    def get_chunks(self, bucket_id, block_id):
+        result = self.server.get_chunks(bucket_id, block_id)
+        self._record('get_chunks', [bucket_id, block_id], result,
+                     bucket_id=bucket_id)
+        return result
+
+    def get_block(self, bucket_id, block_id):
+        result = self.server.get_block(bucket_id, block_id)
+        self._record('get_block', [bucket_id, block_id], result,
+                     bucket_id=bucket_id)
+        return result
+
+    def set_block(self, bucket_id, block_id, block):
+        self.server.set_block(bucket_id, block_id, block)
+        self._record('set_block', [bucket_id, block_id, block], None,
+                     bucket_id=bucket_id)
+
+    def invalidate(self, bucket_id, block_id):
+        self.server.invalidate(bucket_id, block_id)
+        self._record('invalidate', [bucket_id, block_id], None,
+                     bucket_id=bucket_id)
+
+    def set_blocks(self, writes):
+        self.server.set_blocks(writes)
+        self._record('set_blocks', [writes], None,
+                     sent_parts=[(bucket_id, len(remote.encode(
+                         [bucket_id, block_id, block])))
+                         for bucket_id, block_id, block in writes])
+
+    def invalidate_blocks(self, slots):
+        self.server.invalidate_blocks(slots)
+        self._record('invalidate_blocks', [slots], None,
+                     sent_parts=[(bucket_id,
+                                  len(remote.encode([bucket_id, block_id])))
+                                 for bucket_id, block_id in slots])
+
+
+def measure_accesses(client, metered, requests):
+    """Runs client.access(*request) for every request and returns the
+       (bytes sent, bytes received) of each access through metered."""
+    per_access = []
+    for request in requests:
+        sent, received = metered.bytes_sent, metered.bytes_received
+        client.access(*request)
+        per_access.append((metered.bytes_sent - sent,
+                           metered.bytes_received - received))
+    return per_access
+
+
+def plaintext_block_bytes(chunks_per_block, public_key=None,
+                          root_plain_space=1, chunk_bytes=None):
+    """The bytes of data a block holds: every chunk holds a plaintext below
+       n^root_plain_space, or chunk_bytes if there is no key."""
+    if chunk_bytes is None:
+        bits = public_key.get_npows(root_plain_space).bit_length() - 1
+        chunk_bytes = bits / 8
+    return chunks_per_block * chunk_bytes
+
+
+def expansion_by_level(public_key, total_levels, root_plain_space,
+                       max_onion_layers=None):
+    """Per level, root first, the bytes of a stored chunk ciphertext and
+       its ratio to the plaintext chunk."""
+    chunk_bytes, _ = storage.encrypted_layout(
+        public_key, total_levels, root_plain_space,
+        max_onion_layers=max_onion_layers)
+    plain = plaintext_block_bytes(1, public_key, root_plain_space)
+    return [{'level': level, 'chunk_bytes': size,
+             'expansion': float(size) / plain}
+            for level, size in enumerate(chunk_bytes)]
+
+
+def report(metered, per_access, block_bytes, public_key=None,
+           root_plain_space=1, max_onion_layers=None):
+    """A JSON-serializable summary of metered: totals and the bytes of
+       every server method and level, then, over the accesses recorded by
+       measure_accesses(), the bytes per access and the amortized blowup,
+       that is bytes per access over block_bytes. With public_key, the
+       ciphertext expansion of every level is included."""
+    totals = [sent + received for sent, received in per_access]
+    accesses = len(per_access)
+    total = sum(totals)
+    result = {
+        'bytes_sent': metered.bytes_sent,
+        'bytes_received': metered.bytes_received,
+        'calls': dict((name, {'calls': calls, 'bytes_sent': sent,
+                              'bytes_received': received})
+                      for name, (calls, sent, received)
+                      in metered.calls.items()),
+        'levels': dict(('shared' if level is SHARED else str(level),
+                        {'bytes_sent': sent, 'bytes_received': received})
+                       for level, (sent, received)
+                       in metered.levels.items()),
+        'accesses': accesses,
+        'block_bytes': block_bytes,
+    }
+    if accesses > 0:
+        result['per_access'] = {
+            'bytes_sent': sum(s for s, _ in per_access) / float(accesses),
+            'bytes_received': sum(r for _, r in per_access) / float(accesses),
+            'min': min(totals),
+            'max': max(totals),
+            'mean': total / float(accesses)}
+        result['blowup'] = total / float(accesses) / block_bytes
+    if public_key is not None:
+        result['expansion'] = expansion_by_level(
+            public_key, metered.total_levels, root_plain_space,
+            max_onion_layers)
+    return result
@@ -0,0 +1,300 @@
+"""Benchmarks for onion_oram and damgard_jurik.
+
+    python benchmark.py run --levels 3 4 --bits 128 256 -o base.json
+    python benchmark.py compare base.json new.json --threshold 0.1
+
+run sweeps the cross product of the given parameters over the selected
+benchmarks and writes one JSON record per case: throughput, mean, p50 and
+p99 latency in seconds, and the peak RSS in KiB. Every case runs in a
+child process of its own, so that its peak RSS is not that of an earlier
+case; it includes the interpreter and the modules the child starts with.
+--seed makes the data, keys and access sequences repeatable.
+
+compare matches the cases of two runs by benchmark and parameters, prints
+the change of their p50 latencies, and exits with status 1 if any case got
+slower by more than the threshold."""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import timeit
+import arithmetic
+import damgard_jurik
+from damgard_jurik import Payload
+from onion_oram import NonEncServerWrapper, EncServerWrapper
+from onion_oram import Client, Operations
+
+BENCHMARKS = ['access', 'eviction', 'select', 'keygen']
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1,
+                      int(fraction * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {'samples': len(samples),
+            'throughput': len(samples) / total if total > 0 else None,
+            'mean': total / len(samples),
+            'p50': percentile(samples, 0.5),
+            'p99': percentile(samples, 0.99)}
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed(function, *args):
+    start = timeit.default_timer()
+    function(*args)
+    return timeit.default_timer() - start
+
+
+def build_client(wrapper, total_levels, blocks_per_bucket, chunks_per_block,
+                 bits, s):
+    """A Client over a tree holding (1 << total_levels) * 2 random blocks,
+       with eviction_period = blocks_per_bucket. bits and s are only used
+       by the encrypted wrapper."""
+    total_blocks = (1 << total_levels) * 2
+    if wrapper == 'enc':
+        public, private = damgard_jurik.generate_keypair(bits, s)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, s, public,
+                                          private)
+    else:
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block)
+    client = Client(total_levels, total_blocks, blocks_per_bucket,
+                    chunks_per_block, blocks_per_bucket, server_wrapper)
+    client.bulk_load((i, [random.randint(0, 1000)
+                          for _ in range(chunks_per_block)])
+                     for i in range(total_blocks))
+    return client
+
+
+def bench_access(params, samples):
+    client = build_client(**params)
+    latencies = []
+    for _ in range(samples):
+        piece = random.randint(0, client.total_blocks - 1)
+        latencies.append(timed(client.access, piece, Operations.READ))
+    return latencies
+
+
+def bench_eviction(params, samples):
+    client = build_client(**params)
+    latencies = []
+    evict = client._evict_along_path
+
+    def timed_evict(leaf_target):
+        latencies.append(timed(evict, leaf_target))
+    client._evict_along_path = timed_evict
+    while len(latencies) < samples:
+        piece = random.randint(0, client.total_blocks - 1)
+        client.access(piece, Operations.READ)
+    return latencies
+
+
+def bench_select(params, samples):
+    """One chunk selected out of blocks_per_bucket candidates, which carry
+       total_levels onion layers over plaintext space s."""
+    s = params['s']
+    layers = params['total_levels']
+    public, private = damgard_jurik.generate_keypair(params['bits'], s)
+    candidates = params['blocks_per_bucket']
+    payloads = [Payload(random.randint(0, 1000), public, s, s).lift_by(layers)
+                for _ in range(candidates)]
+    selected = random.randint(0, candidates - 1)
+    selectors = [Payload(int(i == selected), public, s + layers,
+                         s + layers).lift_once() for i in range(candidates)]
+    return [timed(damgard_jurik.homomorphic_select, payloads, selectors)
+            for _ in range(samples)]
+
+
+def bench_keygen(params, samples):
+    return [timed(damgard_jurik.generate_keypair, params['bits'],
+                  params['s'])
+            for _ in range(samples)]
+
+
+# the parameters every benchmark is swept over
+PARAMETERS = {
+    'access': ['wrapper', 'total_levels', 'blocks_per_bucket',
+               'chunks_per_block', 'bits', 's'],
+    'eviction': ['wrapper', 'total_levels', 'blocks_per_bucket',
+                 'chunks_per_block', 'bits', 's'],
+    'select': ['total_levels', 'blocks_per_bucket', 'bits', 's'],
+    'keygen': ['bits', 's'],
+}
+
+FUNCTIONS = {
+    'access': bench_access,
+    'eviction': bench_eviction,
+    'select': bench_select,
+    'keygen': bench_keygen,
+}
+
+
+def cases(benchmark, sweep):
+    names = PARAMETERS[benchmark]
+    seen = set()
+    for values in itertools.product(*[sweep[name] for name in names]):
+        params = dict(zip(names, values))
+        if params.get('wrapper') == 'nonenc':
+            # there is no key, so its parameters are not swept
+            params['bits'] = params['s'] = None
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            yield params
+
+
+def _run_case(connection, benchmark, params, samples, seed):
+    # a forked child would otherwise repeat its parent's random sequence
+    random.seed(seed)
+    try:
+        result = summarize(FUNCTIONS[benchmark](params, samples))
+        result['peak_rss_kb'] = peak_rss()
+        connection.send((result, None))
+    except Exception as e:
+        connection.send((None, repr(e)))
+    connection.close()
+
+
+def run_case(benchmark, params, samples, seed=None):
+    """Runs one case in a child process and returns its summary and peak
+       RSS. seed seeds the child's random module, from the system's
+       randomness if None."""
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=_run_case,
+                                      args=(sender, benchmark, params,
+                                            samples, seed))
+    process.start()
+    sender.close()
+    try:
+        result, error = receiver.recv()
+    finally:
+        process.join()
+    if error is not None:
+        raise RuntimeError(benchmark + " " + json.dumps(params) +
+                           " failed: " + error)
+    return result
+
+
+def run(benchmarks, sweep, samples, seed=None, log=None):
+    """Runs every case and returns the JSON-serializable report. With a
+       seed, the n-th case runs with seed + n."""
+    results = []
+    for benchmark in benchmarks:
+        for params in cases(benchmark, sweep):
+            result = {'benchmark': benchmark, 'params': params}
+            case_seed = None if seed is None else seed + len(results)
+            result.update(run_case(benchmark, params, samples, case_seed))
+            results.append(result)
+            if log is not None:
+                log.write('%-9s %s p50=%.6fs p99=%.6fs\n' % (
+                    benchmark, json.dumps(params, sort_keys=True),
+                    result['p50'], result['p99']))
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'backend': arithmetic.BACKEND,
+                     'seed': seed,
+                     'samples': samples,
+                     'time': time.time()},
+            'results': results}
+
+
+def case_key(result):
+    return result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(base, new, threshold=0.1):
+    """Returns (benchmark, params, base p50, new p50, relative change) for
+       every case present in both reports, and the cases among them that
+       got slower by more than threshold."""
+    base_results = dict((case_key(r), r) for r in base['results'])
+    rows = []
+    regressions = []
+    for result in new['results']:
+        key = case_key(result)
+        if key not in base_results:
+            continue
+        before = base_results[key]['p50']
+        after = result['p50']
+        change = (after - before) / before if before > 0 else 0.0
+        row = (key[0], key[1], before, after, change)
+        rows.append(row)
+        if change > threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+
+    run_parser = commands.add_parser('run', help="run a sweep")
+    run_parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS,
+                            default=BENCHMARKS)
+    run_parser.add_argument('--wrappers', nargs='+', choices=['nonenc', 'enc'],
+                            default=['nonenc', 'enc'])
+    run_parser.add_argument('--levels', nargs='+', type=int, default=[3])
+    run_parser.add_argument('--blocks-per-bucket', nargs='+', type=int,
+                            default=[20])
+    run_parser.add_argument('--chunks-per-block', nargs='+', type=int,
+                            default=[4])
+    run_parser.add_argument('--bits', nargs='+', type=int, default=[128])
+    run_parser.add_argument('--s', nargs='+', type=int, default=[1])
+    run_parser.add_argument('--samples', type=int, default=20)
+    run_parser.add_argument('--seed', type=int)
+    run_parser.add_argument('-o', '--output', help="JSON file to write, "
+                            "instead of standard output")
+
+    compare_parser = commands.add_parser('compare', help="compare two runs")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="relative p50 slowdown that counts as "
+                                "a regression")
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        sweep = {'wrapper': args.wrappers,
+                 'total_levels': args.levels,
+                 'blocks_per_bucket': args.blocks_per_bucket,
+                 'chunks_per_block': args.chunks_per_block,
+                 'bits': args.bits,
+                 's': args.s}
+        report = run(args.benchmarks, sweep, args.samples, args.seed,
+                     sys.stderr)
+        if args.output is None:
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        else:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.base) as base_file:
+        base = json.load(base_file)
+    with open(args.new) as new_file:
+        new = json.load(new_file)
+    rows, regressions = compare(base, new, args.threshold)
+    for benchmark, params, before, after, change in rows:
+        print '%-9s %s %.6fs -> %.6fs %+.1f%%%s' % (
+            benchmark, params, before, after, 100 * change,
+            ' REGRESSION' if change > args.threshold else '')
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
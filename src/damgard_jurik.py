@@ -1,12 +1,14 @@
+import collections
 import math
 import random
+import threading
+import arithmetic
+import instrumentation
 import primes
 
 
 def gcd(a, b):
-    while a > 0 and b > 0:
-        (a, b) = (a % b, b) if a >= b else (a, b % a)
-    return a + b
+    return arithmetic.gcd(a, b)
 
 
 def lcm(a, b):
@@ -16,29 +18,14 @@ def lcm(a, b):
 def modpow(base, exponent, modulus):
     """Modular exponent:
          c = b ^ e mod m
-       Returns c.
-       (http://www.programmish.com/?p=34)"""
-    result = 1
-    while exponent > 0:
-        if exponent & 1 == 1:
-            result = (result * base) % modulus
-        exponent = exponent >> 1
-        base = (base * base) % modulus
-    return result
+       Returns c."""
+    if instrumentation.active is not None:
+        instrumentation.active.count('modpow', modulus.bit_length())
+    return arithmetic.powmod(base, exponent, modulus)
 
 
 def modinv(a, b):
-    b0 = b
-    x0, x1 = 0, 1
-    if b == 1:
-        return 1
-    while a > 1:
-        q = a / b
-        a, b = b, a % b
-        x0, x1 = x1 - q * x0, x0
-    if x1 < 0:
-        x1 += b0
-    return x1
+    return arithmetic.invert(a, b)
 
 
 def chinese_remainder(mods, remainders):
@@ -50,19 +37,70 @@ def chinese_remainder(mods, remainders):
     return res % prod
 
 
+# statistical security, in bits, of the mask exponents
+MASK_SECURITY = 128
+
+
+class FixedBaseTable(object):
+    """Windowed table of powers of a fixed base:
+         rows[i][j] = base ^ (j * 2 ^ (window * i)) mod modulus
+       so that base ^ e needs one multiplication per window of e and no
+       squarings at all."""
+    def __init__(self, base, modulus, exponent_bits, window=4):
+        self.modulus = modulus
+        self.window = window
+        self.rows = []
+        base = arithmetic.mpz(base)
+        for _ in range((exponent_bits + window - 1) / window):
+            row = [arithmetic.mpz(1), base % modulus]
+            for _ in range(2, 1 << window):
+                row.append((row[-1] * base) % modulus)
+            self.rows.append(row)
+            base = (row[-1] * base) % modulus
+
+    def pow(self, exponent):
+        assert exponent >> (self.window * len(self.rows)) == 0
+        digit_mask = (1 << self.window) - 1
+        result = 1
+        for row in self.rows:
+            digit = exponent & digit_mask
+            if digit != 0:
+                result = (result * row[digit]) % self.modulus
+            exponent >>= self.window
+        return arithmetic.to_int(result)
+
+
 class PublicKey(object):
     def __init__(self, n, s):
         self.n = n
         self.s = s
         self.cache_n_pow = [1, n]
         self.cache_invfact = {}
+        self.cache_mask_table = {}
+        self.cache_lock = threading.Lock()
+        self.pool = None
         self.bits = long(math.ceil(math.log(n, 2)))
 
+        # All encryption randomness is drawn as h ^ (n ^ s * x) for a fixed
+        # h = -y ^ 2 mod n, as in the Damgard-Jurik-Nielsen variant, which
+        # lets us precompute a table per level s. The masks only range over
+        # the subgroup generated by h, so semantic security rests on the
+        # DJN assumption that they are indistinguishable from random n^s-th
+        # residues, rather than on the plain DCR assumption. x is drawn
+        # MASK_SECURITY bits wider than n, so that it is statistically
+        # close to uniform modulo the order of h.
+        y = random.getrandbits(self.bits) % n
+        while gcd(y, n) != 1:
+            y = random.getrandbits(self.bits) % n
+        self.mask_base = (-y * y) % n
+        self.mask_bits = self.bits + MASK_SECURITY
+
     def get_npows(self, i):
         if i < len(self.cache_n_pow):
             return self.cache_n_pow[i]
-        while i >= len(self.cache_n_pow):
-            self.cache_n_pow.append(self.cache_n_pow[-1] * self.n)
+        with self.cache_lock:
+            while i >= len(self.cache_n_pow):
+                self.cache_n_pow.append(self.cache_n_pow[-1] * self.n)
         return self.cache_n_pow[i]
 
     def get_invfact(self, i, j):
@@ -73,13 +111,147 @@ class PublicKey(object):
         self.cache_invfact[(i, j)] = res
         return res
 
+    def get_mask_table(self, s):
+        if s in self.cache_mask_table:
+            return self.cache_mask_table[s]
+        modulus = self.get_npows(s + 1)
+        base = modpow(self.mask_base, self.get_npows(s), modulus)
+        table = FixedBaseTable(base, modulus, self.mask_bits)
+        self.cache_mask_table[s] = table
+        return table
+
+    def compute_mask(self, s):
+        """Returns a random n^s-th residue modulo n^(s+1) from the subgroup
+           generated by mask_base."""
+        return self.get_mask_table(s).pow(random.getrandbits(self.mask_bits))
+
+    def get_mask(self, s):
+        if self.pool is not None:
+            return self.pool.get(s)
+        return self.compute_mask(s)
+
+    def get_g_pow(self, s, m):
+        """Computes (1 + n) ^ m mod n^(s+1) through the binomial expansion
+             sum_{k=0}^{s} C(m, k) * n^k
+           which only needs s multiplications instead of a full modpow."""
+        modulus = self.get_npows(s + 1)
+        m %= self.get_npows(s)
+        # C(m, k) is only needed modulo n^(s+1-k), so the falling factorial
+        # m (m - 1) ... (m - k + 1) is kept modulo s! * n^s.
+        falling_modulus = reduce(lambda x, y: x * y, range(1, s + 1), 1) * \
+            self.get_npows(s)
+        falling = 1
+        fact = 1
+        result = 1
+        for k in range(1, s + 1):
+            falling = (falling * (m - k + 1)) % falling_modulus
+            fact *= k
+            binom = (falling % (fact * self.get_npows(s + 1 - k))) / fact
+            result = (result + binom * self.get_npows(k)) % modulus
+        return result
+
+
+class RandomnessPool(object):
+    """Precomputed encryption masks r^(n^s) mod n^(s+1), kept per level s.
+
+       Once started, the pool is attached to its public key, so that
+       encrypt() and homomorphic_scalar_multiply() take their masks from
+       it. A background thread refills a level up to high_watermark as
+       soon as it drops below low_watermark; when a level runs dry the
+       mask is computed inline."""
+    def __init__(self, public_key, low_watermark=16, high_watermark=64):
+        assert 0 <= low_watermark <= high_watermark
+        self.public_key = public_key
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.masks = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(masks) for masks in self.masks.values())
+
+    def available(self, s):
+        with self.condition:
+            return len(self.masks.get(s, ()))
+
+    def fill(self, s, count=None):
+        """Synchronously tops level s up to count (high_watermark by
+           default) masks."""
+        if count is None:
+            count = self.high_watermark
+        with self.condition:
+            masks = self.masks.setdefault(s, collections.deque())
+            missing = count - len(masks)
+        for _ in range(missing):
+            mask = self.public_key.compute_mask(s)
+            with self.condition:
+                masks.append(mask)
+
+    def get(self, s):
+        with self.condition:
+            masks = self.masks.setdefault(s, collections.deque())
+            mask = masks.popleft() if len(masks) > 0 else None
+            if len(masks) < self.low_watermark:
+                self.condition.notify()
+        if mask is None:
+            mask = self.public_key.compute_mask(s)
+        return mask
+
+    def start(self):
+        if self.thread is not None:
+            return self
+        self.running = True
+        self.thread = threading.Thread(target=self._refill)
+        self.thread.daemon = True
+        self.thread.start()
+        self.public_key.pool = self
+        return self
+
+    def stop(self):
+        if self.public_key.pool is self:
+            self.public_key.pool = None
+        if self.thread is None:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+
+    def _next_level(self):
+        for s, masks in self.masks.items():
+            if len(masks) < self.low_watermark:
+                return s
+        return None
+
+    def _refill(self):
+        while True:
+            with self.condition:
+                while self.running and self._next_level() is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                s = self._next_level()
+                missing = self.high_watermark - len(self.masks[s])
+            for _ in range(missing):
+                if not self.running:
+                    return
+                mask = self.public_key.compute_mask(s)
+                with self.condition:
+                    self.masks[s].append(mask)
+
 
 class PrivateKey(object):
-    def __init__(self, n, p, q, s):
+    def __init__(self, n, p, q, s, crt=True):
         self.n = n
         self.p = p
         self.q = q
+        self.crt = crt
         self.cache_d = {}
+        self.cache_crt = {}
 
     def get_d(self, s):
         if s in self.cache_d:
@@ -88,34 +260,49 @@ class PrivateKey(object):
         self.cache_d[s] = chinese_remainder([self.n ** s, lambda_], [1, 0])
         return self.cache_d[s]
 
-
-def generate_keypair(bits, s):
-    p = primes.generate_prime(bits / 2)
-    q = primes.generate_prime(bits / 2)
+    def get_crt(self, s):
+        """Returns (p^(s+1), q^(s+1), d_p, d_q, p^-(s+1) mod q^(s+1)), where
+           d_p and d_q are d reduced modulo the orders of the groups of
+           units modulo p^(s+1) and q^(s+1)."""
+        if s in self.cache_crt:
+            return self.cache_crt[s]
+        d = self.get_d(s)
+        p_pow = self.p ** (s + 1)
+        q_pow = self.q ** (s + 1)
+        d_p = d % (self.p ** s * (self.p - 1))
+        d_q = d % (self.q ** s * (self.q - 1))
+        p_pow_inv = modinv(p_pow % q_pow, q_pow)
+        self.cache_crt[s] = (p_pow, q_pow, d_p, d_q, p_pow_inv)
+        return self.cache_crt[s]
+
+    def pow_d(self, s, c):
+        """Computes c ^ d mod n^(s+1) modulo p^(s+1) and q^(s+1)
+           separately and recombines the halves (Garner's formula)."""
+        p_pow, q_pow, d_p, d_q, p_pow_inv = self.get_crt(s)
+        c_p = modpow(c % p_pow, d_p, p_pow)
+        c_q = modpow(c % q_pow, d_q, q_pow)
+        return c_p + p_pow * (((c_q - c_p) * p_pow_inv) % q_pow)
+
+
+def generate_keypair(bits, s, processes=None):
+    """With processes, p and q are searched for concurrently on a pool of
+       that many processes."""
+    p, q = primes.generate_distinct_primes(bits / 2, 2, processes)
     n = p * q
     return PublicKey(n, s), PrivateKey(n, p, q, s)
 
 
 def encrypt(pub, s, plaintext):
-    m = plaintext
-    g = pub.n + 1
-
-    r = random.getrandbits(pub.bits) % pub.get_npows(s + 1)
-
-    # TODO(aanastasov): This has to be removed, because p and q should be
-    # chosen so big that this is impractical: if we can factor n, then we
-    # can break the security of the cryptosystem. However, we are keeping
-    # it here to ensure that the cryptosystem doesn't give wrong results
-    # when testing with small p and q.
-    while gcd(r, pub.get_npows(s + 1)) != 1:
-        r = random.getrandbits(pub.bits) % pub.get_npows(s + 1)
-
-    g_pow_m = modpow(g, m, pub.get_npows(s + 1))
-    r_pow__n_pow_s = modpow(r, pub.get_npows(s), pub.get_npows(s + 1))
+    if instrumentation.active is not None:
+        instrumentation.active.count('encrypt', s)
+    g_pow_m = pub.get_g_pow(s, plaintext)
+    r_pow__n_pow_s = pub.get_mask(s)
     return (g_pow_m * r_pow__n_pow_s) % pub.get_npows(s + 1)
 
 
 def decrypt(pub, private, s, ciphertext):
+    if instrumentation.active is not None:
+        instrumentation.active.count('decrypt', s)
     c = ciphertext
     n = pub.n
 
@@ -123,7 +310,10 @@ def decrypt(pub, private, s, ciphertext):
         return 0 if u == 0 else (u - 1) / n
 
     m = 0
-    c_pow_d = modpow(c, private.get_d(s), pub.get_npows(s + 1))
+    if private.crt:
+        c_pow_d = private.pow_d(s, c)
+    else:
+        c_pow_d = modpow(c, private.get_d(s), pub.get_npows(s + 1))
     for j in range(1, s + 1):
         new_m = l(c_pow_d % pub.get_npows(j + 1))
         old_m = m
@@ -184,40 +374,58 @@ def homomorphic_add(x, y):
 
 def homomorphic_scalar_multiply(hidden, selector):
     public = hidden.public_key
-    modulus_plain = public.get_npows(selector.current_space - 1)
     modulus_cipher = public.get_npows(selector.current_space)
     new_payload = modpow(selector.payload, hidden.payload,
                          modulus_cipher)
-    r = random.getrandbits(public.bits) % modulus_cipher
-    r = modpow(r, modulus_plain, modulus_cipher)
+    r = public.get_mask(selector.current_space - 1)
     new_payload = (new_payload * r) % modulus_cipher
     return Payload(new_payload, hidden.public_key,
                    hidden.plaintext_space, hidden.current_space + 1)
 
 
 def homomorphic_select(payloads, selectors):
-    # all plaintexts must be from the same space
-    assert all([payloads[i].plaintext_space == payloads[0].plaintext_space
-                for i in range(len(payloads))])
+    return homomorphic_select_many([payloads], selectors)[0]
 
-    assert len(payloads) == len(selectors)
-    max_onion_layers = max([payload.current_space - payload.plaintext_space
-                            for payload in payloads])
 
-#    assert all([s.plaintext_space == payloads[0].current_space
-#               for s in selectors])
+def homomorphic_select_many(payload_rows, selectors):
+    """Runs homomorphic_select(payload_rows[c], selectors) for every row c.
+       The selector window tables are built once and shared by all rows."""
     assert all([s.current_space - s.plaintext_space == 1
                 for s in selectors])
-
-    # lift payloads so that they have the same number of layers
-    for i in range(len(payloads)):
-        delta = max_onion_layers - (payloads[i].current_space -
-                                    payloads[i].plaintext_space)
-        payloads[i] = payloads[i].lift_by(delta)
-        curr_diff = payloads[i].current_space - payloads[i].plaintext_space
-        assert curr_diff == max_onion_layers
-
-    merged = []
-    for i in range(len(payloads)):
-        merged.append(homomorphic_scalar_multiply(payloads[i], selectors[i]))
-    return reduce(lambda x, y: homomorphic_add(x, y), merged)
+    public = selectors[0].public_key
+    modulus = public.get_npows(selectors[0].current_space)
+    table = arithmetic.MultiExpTable([s.payload for s in selectors], modulus)
+
+    selected = []
+    for payloads in payload_rows:
+        if instrumentation.active is not None:
+            instrumentation.active.count('select',
+                                         selectors[0].current_space)
+        # all plaintexts must be from the same space
+        assert all([payloads[i].plaintext_space ==
+                    payloads[0].plaintext_space
+                    for i in range(len(payloads))])
+
+        assert len(payloads) == len(selectors)
+        max_onion_layers = max([payload.current_space -
+                                payload.plaintext_space
+                                for payload in payloads])
+
+        # lift payloads so that they have the same number of layers
+        lifted = []
+        for payload in payloads:
+            delta = max_onion_layers - (payload.current_space -
+                                        payload.plaintext_space)
+            lifted.append(payload.lift_by(delta))
+            curr_diff = lifted[-1].current_space - lifted[-1].plaintext_space
+            assert curr_diff == max_onion_layers
+
+        # prod_i selector_i ^ payload_i is evaluated as one
+        # multi-exponentiation and re-randomized once, instead of once per
+        # term
+        product = table.pow([p.payload for p in lifted])
+        r = public.get_mask(selectors[0].current_space - 1)
+        selected.append(Payload((product * r) % modulus, public,
+                                lifted[0].plaintext_space,
+                                lifted[0].current_space + 1))
+    return selected
@@ -0,0 +1,180 @@
+"""Optional counters and timers for damgard_jurik and onion_oram.
+
+Nothing is recorded until enable() installs a Recorder; until then every
+hook is a single check of the module global `active`.
+
+    recorder = instrumentation.enable(trace=True)
+    client.access(...)
+    instrumentation.disable()
+    recorder.report()
+
+A Recorder collects:
+    counts   -- (operation, key) -> calls: encrypt, decrypt and select by
+                space s, modpow by modulus bits
+    phases   -- phase name -> [calls, seconds]; phases nest, and the time
+                of a phase includes the phases inside it
+    calls    -- server method -> [calls, bytes sent, bytes received], as
+                sized by bandwidth.MeteredServer, for the servers wrapped
+                by measure_server() or by a MeteredServer of their own
+    evictions, eviction_pushes -- evicted paths and moved blocks
+    trace    -- with trace=True, one record per Client access with what it
+                added to each of the above; the accesses that
+                Client.access_many() serves together share the record of
+                their batch, whose size is in 'batch'"""
+
+import timeit
+
+# the Recorder that the hooks report to, if any
+active = None
+
+
+def enable(trace=False):
+    global active
+    active = Recorder(trace)
+    return active
+
+
+def disable():
+    global active
+    recorder = active
+    active = None
+    return recorder
+
+
+def count(operation, key):
+    if active is not None:
+        active.count(operation, key)
+
+
+class _Phase(object):
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_time(self.name,
+                               timeit.default_timer() - self.start)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """A context manager that times a phase, if recording."""
+    if active is None:
+        return _NO_PHASE
+    return _Phase(active, name)
+
+
+class Recorder(object):
+    def __init__(self, trace=False):
+        self.counts = {}
+        self.phases = {}
+        self.calls = {}
+        self.evictions = 0
+        self.eviction_pushes = 0
+        self.tracing = trace
+        self.trace = []
+        self._batch = None
+
+    def count(self, operation, key):
+        self.counts[(operation, key)] = \
+            self.counts.get((operation, key), 0) + 1
+
+    def add_time(self, name, seconds):
+        entry = self.phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def add_call(self, name, sent, received):
+        entry = self.calls.setdefault(name, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += sent
+        entry[2] += received
+
+    def add_eviction(self, pushes):
+        self.evictions += 1
+        self.eviction_pushes += pushes
+
+    def _snapshot(self):
+        return (dict(self.counts),
+                dict((k, list(v)) for k, v in self.phases.items()),
+                dict((k, list(v)) for k, v in self.calls.items()),
+                self.evictions, self.eviction_pushes)
+
+    def begin_access(self, block_id):
+        self.begin_batch([block_id])
+
+    def begin_batch(self, block_ids):
+        if self.tracing:
+            self._batch = (list(block_ids), timeit.default_timer(),
+                           self._snapshot())
+
+    def end_access(self):
+        if self._batch is None:
+            return
+        block_ids, start, (counts, phases, calls, evictions, pushes) = \
+            self._batch
+        self._batch = None
+
+        def delta(now, before):
+            changed = {}
+            for key, value in now.items():
+                if isinstance(value, list):
+                    old = before.get(key, [0] * len(value))
+                    value = [a - b for a, b in zip(value, old)]
+                    if value[0] != 0:
+                        changed[key] = value
+                elif value != before.get(key, 0):
+                    changed[key] = value - before.get(key, 0)
+            return changed
+        entry = {
+            'batch': len(block_ids),
+            'seconds': timeit.default_timer() - start,
+            'counts': delta(self.counts, counts),
+            'phases': delta(self.phases, phases),
+            'calls': delta(self.calls, calls),
+            'evictions': self.evictions - evictions,
+            'eviction_pushes': self.eviction_pushes - pushes}
+        for block_id in block_ids:
+            self.trace.append(dict(entry, block_id=block_id))
+
+    def report(self):
+        """A JSON-serializable summary; tuple keys become 'operation:key'."""
+        return {
+            'counts': dict(('%s:%s' % key, value)
+                           for key, value in self.counts.items()),
+            'phases': dict((name, {'calls': calls, 'seconds': seconds})
+                           for name, (calls, seconds) in self.phases.items()),
+            'calls': dict((name, {'calls': calls, 'bytes_sent': sent,
+                                  'bytes_received': received})
+                          for name, (calls, sent, received)
+                          in self.calls.items()),
+            'evictions': self.evictions,
+            'eviction_pushes': self.eviction_pushes,
+            'trace': [dict(entry, counts=dict(
+                ('%s:%s' % key, value)
+                for key, value in entry['counts'].items()))
+                for entry in self.trace]}
+
+
+def measure_server(server_wrapper):
+    """Puts a bandwidth.MeteredServer between server_wrapper and its
+       server, unless there is one already, so that the bytes of their
+       calls are reported. Returns the server to restore afterwards."""
+    import bandwidth
+    server = server_wrapper.server
+    if not isinstance(server, bandwidth.MeteredServer):
+        server_wrapper.server = bandwidth.MeteredServer(server)
+    return server
@@ -0,0 +1,75 @@
+"""Codecs for the block metadata kept on the server.
+
+The address and leaf target of every block are only ever written and read
+back by the client, never computed on, so they need not be homomorphic. A
+codec turns a non-negative integer into a non-negative integer ciphertext
+of at most ciphertext_bytes bytes and back:
+
+    DamgardJurikCodec -- a Damgard-Jurik ciphertext of space 1; the
+                         default of onion_oram.EncServerWrapper
+    HmacCodec         -- a stream cipher built from HMAC-SHA256 in counter
+                         mode, which costs a few hashes instead of a
+                         modular exponentiation"""
+
+import binascii
+import hashlib
+import hmac
+import os
+import struct
+from damgard_jurik import Payload
+
+
+class DamgardJurikCodec(object):
+    def __init__(self, public_key, private_key):
+        self.public_key = public_key
+        self.private_key = private_key
+        self.ciphertext_bytes = \
+            (public_key.get_npows(2).bit_length() + 7) / 8
+
+    def encrypt(self, value):
+        return Payload(value, self.public_key, 1, 1).lift_once().payload
+
+    def decrypt(self, ciphertext):
+        return Payload(ciphertext, self.public_key, 1, 2).get_plaintext(
+            self.private_key).payload
+
+
+class HmacCodec(object):
+    """Encrypts a value of up to value_bits bits as nonce || value xor
+       keystream, where the keystream is HMAC-SHA256(key, nonce || i) for
+       i = 0, 1, ... The ciphertext is not authenticated."""
+    NONCE_BYTES = 16
+
+    def __init__(self, key=None, value_bits=64):
+        if key is None:
+            key = os.urandom(32)
+        self.key = key
+        self.value_bits = value_bits
+        self.value_bytes = (value_bits + 7) / 8
+        self.ciphertext_bytes = self.NONCE_BYTES + self.value_bytes
+
+    def _keystream(self, nonce):
+        blocks = []
+        for i in range((self.value_bytes + 31) / 32):
+            blocks.append(hmac.new(self.key, nonce + struct.pack('<I', i),
+                                   hashlib.sha256).digest())
+        stream = ''.join(blocks)[:self.value_bytes]
+        return int(binascii.hexlify(stream), 16) & \
+            ((1 << self.value_bits) - 1)
+
+    def encrypt(self, value):
+        if value < 0 or value >> self.value_bits != 0:
+            raise ValueError(str(value) + " does not fit in " +
+                             str(self.value_bits) + " bits.")
+        # a zero nonce is avoided, so that no ciphertext is zero
+        nonce = '\0' * self.NONCE_BYTES
+        while nonce == '\0' * self.NONCE_BYTES:
+            nonce = os.urandom(self.NONCE_BYTES)
+        return (int(binascii.hexlify(nonce), 16) << self.value_bits) | \
+            (value ^ self._keystream(nonce))
+
+    def decrypt(self, ciphertext):
+        nonce = binascii.unhexlify('%0*x' % (2 * self.NONCE_BYTES,
+                                             ciphertext >> self.value_bits))
+        return (ciphertext & ((1 << self.value_bits) - 1)) ^ \
+            self._keystream(nonce)
@@ -0,0 +1,135 @@
+"""A plaintext server wrapper backed by NumPy arrays.
+
+NumpyServerWrapper is a drop-in replacement for
+onion_oram.NonEncServerWrapper that keeps the whole tree in a few arrays:
+the chunks in one (bucket, slot, chunk) array and the metadata in
+(bucket, slot) arrays. A batch of selections is one gather from the chunk
+array and a batch of block writes one scatter into it, so an eviction
+wave costs two array operations. It is meant as an upper bound for the
+protocol logic, to compare the encrypted tier against. Chunks must fit in
+dtype, int64 by default.
+
+NumPy is required by this module."""
+
+import numpy
+from onion_oram import Block, path_bucket_ids
+
+
+class NumpyServerWrapper(object):
+    def __init__(self, total_levels, blocks_per_bucket, chunks_per_block,
+                 dtype=numpy.int64):
+        self.total_levels = total_levels
+        self.blocks_per_bucket = blocks_per_bucket
+        self.chunks_per_block = chunks_per_block
+
+        total_buckets = (1 << (total_levels + 1)) - 1
+        shape = (total_buckets, blocks_per_bucket)
+        self.chunks = numpy.zeros(shape + (chunks_per_block,), dtype=dtype)
+        # -1 marks a dummy slot
+        self.addresses = numpy.full(shape, -1, dtype=numpy.int64)
+        self.leaf_targets = numpy.full(shape, -1, dtype=numpy.int64)
+        # the chunks_per_block of every stored block
+        self.chunk_counts = numpy.zeros(shape, dtype=numpy.int64)
+
+    def get_addresses(self, target):
+        """The rows come as one int64 array, which the client scans and
+           hands back without converting it, see path_scan.py."""
+        buckets = path_bucket_ids(self.total_levels, target)
+        return buckets, self.addresses[buckets]
+
+    def get_bucket_addresses(self, bucket_ids):
+        return self.addresses[list(bucket_ids)].tolist()
+
+    def set_addresses(self, buckets, addresses):
+        self.addresses[list(buckets)] = numpy.asarray(addresses,
+                                                      dtype=numpy.int64)
+
+    def select_block(self, bucket_ids, select_vector):
+        return self.select_blocks([(bucket_ids, select_vector)])[0]
+
+    def select_blocks(self, requests):
+        """Checks every select vector and gathers all the selected blocks
+           with one indexing operation."""
+        buckets = []
+        slots = []
+        for bucket_ids, select_vector in requests:
+            select_vector = numpy.asarray(select_vector)
+            assert select_vector.shape == (len(bucket_ids),
+                                           self.blocks_per_bucket)
+            assert ((select_vector == 0) | (select_vector == 1)).all()
+            assert select_vector.sum() == 1
+            i, j = numpy.nonzero(select_vector)
+            buckets.append(bucket_ids[i[0]])
+            slots.append(j[0])
+        if len(requests) == 0:
+            return []
+        selected = self.chunks[buckets, slots]
+        counts = self.chunk_counts[buckets, slots]
+        return [selected[k, :counts[k]].tolist()
+                for k in range(len(requests))]
+
+    def is_dummy(self, bucket_id, block_id):
+        return bool(self.addresses[bucket_id, block_id] < 0)
+
+    def get_block(self, bucket_id, block_id):
+        address = int(self.addresses[bucket_id, block_id])
+        if address < 0:
+            return Block(self.chunks_per_block)
+        count = int(self.chunk_counts[bucket_id, block_id])
+        return Block(count, address,
+                     int(self.leaf_targets[bucket_id, block_id]),
+                     self.chunks[bucket_id, block_id, :count].tolist())
+
+    def get_metadata(self, bucket_id, block_id):
+        return int(self.addresses[bucket_id, block_id]), \
+            int(self.leaf_targets[bucket_id, block_id]), \
+            int(self.chunk_counts[bucket_id, block_id])
+
+    def dummy_map(self, bucket_ids):
+        return (self.addresses[list(bucket_ids)] < 0).tolist()
+
+    def get_bucket_metadata(self, bucket_ids):
+        bucket_ids = list(bucket_ids)
+        return [[None if address < 0 else (address, leaf_target, count)
+                 for address, leaf_target, count in zip(*columns)]
+                for columns in zip(self.addresses[bucket_ids].tolist(),
+                                   self.leaf_targets[bucket_ids].tolist(),
+                                   self.chunk_counts[bucket_ids].tolist())]
+
+    def invalidate(self, bucket_id, block_id):
+        self.addresses[bucket_id, block_id] = -1
+        self.leaf_targets[bucket_id, block_id] = -1
+        self.chunk_counts[bucket_id, block_id] = 0
+
+    def invalidate_blocks(self, slots):
+        for bucket_id, block_id in slots:
+            self.invalidate(bucket_id, block_id)
+
+    def set_block(self, bucket_id, block_id, block):
+        self.set_blocks([(bucket_id, block_id, block)])
+
+    def set_blocks(self, writes):
+        """Scatters all the written blocks with one indexing operation."""
+        real = []
+        for bucket_id, block_id, block in writes:
+            if block.is_dummy():
+                self.invalidate(bucket_id, block_id)
+            else:
+                real.append((bucket_id, block_id, block))
+        if len(real) == 0:
+            return
+        buckets = [bucket_id for bucket_id, _, _ in real]
+        slots = [block_id for _, block_id, _ in real]
+        rows = numpy.zeros((len(real), self.chunks_per_block),
+                           dtype=self.chunks.dtype)
+        for k, (_, _, block) in enumerate(real):
+            chunks = block.chunks[:block.chunks_per_block]
+            rows[k, :len(chunks)] = chunks
+        self.chunks[buckets, slots] = rows
+        self.addresses[buckets, slots] = [block.address
+                                          for _, _, block in real]
+        self.leaf_targets[buckets, slots] = [block.bucket_leaf_target
+                                             for _, _, block in real]
+        self.chunk_counts[buckets, slots] = [
+            len(block.chunks[:block.chunks_per_block])
+            for _, _, block in real]
@@ -1,10 +1,21 @@
 import utils
-import copy
+import multiprocessing
 import random
-from damgard_jurik import Payload, homomorphic_select
+import threading
+import damgard_jurik
+import instrumentation
+import metadata
+from path_scan import scan_path
+from damgard_jurik import Payload, homomorphic_select_many
 
 VERBOSE_DEBUGGING = False
 
+# Blocks are handed across the server wrapper interface by reference and
+# never copied: a server keeps the blocks it is given and replaces, rather
+# than modifies, the blocks it has handed out. With CHECK_ALIASING, every
+# stored block is frozen, so that breaking this rule raises right away.
+CHECK_ALIASING = False
+
 Operations = utils.enum(READ=1, WRITE=2)
 
 
@@ -23,11 +34,33 @@ class Block(object):
     def is_dummy(self):
         return self.address < 0
 
+    def with_address(self, address):
+        """A copy of this block with a different address, sharing chunks."""
+        block = Block(self.chunks_per_block, -1, self.bucket_leaf_target)
+        block.address = address
+        if hasattr(self, 'chunks'):
+            block.chunks = self.chunks
+        return block
+
+    def freeze(self):
+        if hasattr(self, 'chunks') and self.chunks is not None:
+            self.chunks = tuple(self.chunks)
+        self.__class__ = FrozenBlock
+        return self
+
     def __str__(self):
         return ("address = " + str(self.address) + ", leaf_target= " +
                 str(self.bucket_leaf_target))
 
 
+class FrozenBlock(Block):
+    def __setattr__(self, name, value):
+        raise AttributeError("Trying to modify a block owned by a server.")
+
+    def freeze(self):
+        return self
+
+
 class Bucket(object):
     def __init__(self, blocks_per_bucket, chunks_per_block):
         self.blocks_per_bucket = blocks_per_bucket
@@ -36,7 +69,100 @@ class Bucket(object):
                        for _ in range(blocks_per_bucket)]
 
 
-class Server(object):
+def onion_layers(bucket_id, max_onion_layers=None):
+    """Number of encryption layers that chunks stored in bucket_id carry on
+       top of the root plaintext space: one more per level of depth, up to
+       max_onion_layers if it is given."""
+    res = 1
+    while bucket_id > 0:
+        bucket_id = (bucket_id - 1) / 2
+        res += 1
+    if max_onion_layers is not None:
+        res = min(res, max_onion_layers)
+    return res
+
+
+def path_bucket_ids(total_levels, leaf_target):
+    """The buckets on the path to leaf_target, root first."""
+    bucket_at = leaf_target + (1 << total_levels) - 1
+    buckets = []
+    for _ in range(total_levels + 1):
+        buckets.append(bucket_at)
+        bucket_at = (bucket_at - 1) / 2
+    buckets.reverse()
+    return buckets
+
+
+class ServerOperations(object):
+    """Operations that every server provides on top of its storage
+       primitives, so that they run next to the data."""
+    def get_addresses(self, target):
+        buckets = path_bucket_ids(self.total_levels, target)
+        return buckets, self.get_bucket_addresses(buckets)
+
+    def dummy_map(self, bucket_ids):
+        return [[self.is_dummy(bucket_id, j)
+                 for j in range(self.blocks_per_bucket)]
+                for bucket_id in bucket_ids]
+
+    def get_bucket_metadata(self, bucket_ids):
+        """Per bucket, the get_metadata() of every slot, or None for a
+           dummy slot."""
+        return [[None if self.is_dummy(bucket_id, j)
+                 else self.get_metadata(bucket_id, j)
+                 for j in range(self.blocks_per_bucket)]
+                for bucket_id in bucket_ids]
+
+    def set_blocks(self, writes):
+        for bucket_id, block_id, block in writes:
+            self.set_block(bucket_id, block_id, block)
+
+    def invalidate_blocks(self, slots):
+        for bucket_id, block_id in slots:
+            self.invalidate(bucket_id, block_id)
+
+    def select_rows(self, public_key, plaintext_space, requests,
+                    executor=None, workers=None):
+        """The server side of EncServerWrapper.select_blocks(). Every
+           request is (selectors, candidates, spaces): the selector
+           ciphertexts for the (bucket_id, block_id) candidates, whose
+           chunks are from the given spaces. Returns, per request, the
+           selected ciphertext of every chunk."""
+        prepared = []
+        for selectors, candidates, spaces in requests:
+            # one row per chunk, one column per candidate block
+            rows = [[] for _ in range(self.chunks_per_block)]
+            for bucket_id, block_id in candidates:
+                chunks = self.get_chunks(bucket_id, block_id)
+                for c in range(self.chunks_per_block):
+                    rows[c].append(chunks[c])
+            prepared.append((selectors, spaces, rows))
+
+        if executor is None:
+            return [_select_rows(public_key, selectors, spaces,
+                                 plaintext_space, rows)
+                    for selectors, spaces, rows in prepared]
+
+        # hand each task a contiguous batch of rows, so that the selector
+        # tables are built once per batch
+        tasks = []
+        owners = []
+        for index, (selectors, spaces, rows) in enumerate(prepared):
+            batches = workers or len(rows)
+            for b in range(batches):
+                batch = rows[b * len(rows) / batches:
+                             (b + 1) * len(rows) / batches]
+                if len(batch) > 0:
+                    tasks.append((selectors, spaces, plaintext_space, batch))
+                    owners.append(index)
+        selected = [[] for _ in prepared]
+        for index, result in zip(owners, executor.map(_select_rows_in_worker,
+                                                      tasks)):
+            selected[index].extend(result)
+        return selected
+
+
+class Server(ServerOperations):
     def __init__(self, total_levels, blocks_per_bucket, chunks_per_block):
         self.total_levels = total_levels
         self.blocks_per_bucket = blocks_per_bucket
@@ -46,162 +172,290 @@ class Server(object):
         self.buckets = [Bucket(blocks_per_bucket, chunks_per_block)
                         for _ in range(total_buckets)]
 
-    def get_addresses(self, target):
-        bucket_at = target + (1 << self.total_levels) - 1
-
-        buckets = []
-        addresses = []
-        for _ in range(self.total_levels + 1):
-            buckets.append(bucket_at)
-            addresses.append([block.address
-                             for block in self.buckets[bucket_at].blocks])
-            bucket_at = (bucket_at - 1) / 2
-        addresses.reverse()
-        buckets.reverse()
-        return buckets, addresses
+    def get_bucket_addresses(self, bucket_ids):
+        return [[block.address for block in self.buckets[bucket_id].blocks]
+                for bucket_id in bucket_ids]
 
     def set_addresses(self, buckets, addresses):
         for i in range(len(buckets)):
-            bucket = buckets[i]
+            blocks = self.buckets[buckets[i]].blocks
             for j in range(self.blocks_per_bucket):
-                self.buckets[bucket].blocks[j].address = addresses[i][j]
+                if blocks[j].address != addresses[i][j]:
+                    self.set_block(buckets[i], j,
+                                   blocks[j].with_address(addresses[i][j]))
+
+    def is_dummy(self, bucket_id, block_id):
+        return self.buckets[bucket_id].blocks[block_id].is_dummy()
+
+    def get_block(self, bucket_id, block_id):
+        return self.buckets[bucket_id].blocks[block_id]
+
+    def set_block(self, bucket_id, block_id, block):
+        if CHECK_ALIASING:
+            block.freeze()
+        self.buckets[bucket_id].blocks[block_id] = block
+
+    def get_metadata(self, bucket_id, block_id):
+        ref = self.buckets[bucket_id].blocks[block_id]
+        return ref.address, ref.bucket_leaf_target
+
+    def get_chunks(self, bucket_id, block_id):
+        return self.buckets[bucket_id].blocks[block_id].chunks
+
+    def invalidate(self, bucket_id, block_id):
+        self.set_block(bucket_id, block_id, Block(self.chunks_per_block))
+
+
+def _select_rows(public_key, selectors, spaces, plaintext_space, rows):
+    """Homomorphically selects every chunk row; selectors are ciphertexts
+       from the same space and spaces[i] is the space of column i."""
+    selector_space = max(spaces) + 1
+    selector_payloads = [Payload(x, public_key, selector_space - 1,
+                                 selector_space) for x in selectors]
+    payload_rows = [[Payload(x, public_key, plaintext_space, spaces[i])
+                     for i, x in enumerate(row)] for row in rows]
+    return [chunk.payload for chunk in
+            homomorphic_select_many(payload_rows, selector_payloads)]
+
+
+def _encrypt_chunks(public_key, plaintext_space, onion_layers, chunks):
+    return [Payload(x, public_key, plaintext_space,
+                    plaintext_space).lift_by(onion_layers).payload
+            for x in chunks]
+
+
+# the public key held by a select pool worker, see create_select_pool()
+_worker_public_key = None
+
+
+def _init_select_worker(n, s):
+    global _worker_public_key
+    # forked workers inherit the parent's random state, so reseed them to
+    # keep their encryption masks independent
+    random.seed()
+    _worker_public_key = damgard_jurik.PublicKey(n, s)
+
+
+def _select_rows_in_worker(task):
+    return _select_rows(_worker_public_key, *task)
+
+
+def _encrypt_chunks_in_worker(task):
+    return _encrypt_chunks(_worker_public_key, *task)
+
+
+def create_select_pool(public_key, processes=None):
+    """Creates a multiprocessing pool whose workers hold public_key and can
+       serve EncServerWrapper's chunk selections and re-encryptions."""
+    return multiprocessing.Pool(processes, _init_select_worker,
+                                (public_key.n, public_key.s))
 
 
 class EncServerWrapper(object):
     def __init__(self, total_levels, blocks_per_bucket,
                  chunks_per_block, root_plain_space,
-                 public_key, private_key):
+                 public_key, private_key, workers=None, executor=None,
+                 server=None, metadata_codec=None, max_onion_layers=None):
+        """If workers is given, or executor is a pool built by
+           create_select_pool(), chunk selections and block re-encryptions
+           run in parallel across the pool's processes. server replaces the
+           default in-memory Server, e.g. with a storage.ArrayServer.
+           metadata_codec encrypts the addresses and leaf targets, by
+           default as Damgard-Jurik ciphertexts, see metadata.py.
+
+           max_onion_layers caps the layers of the chunks below a depth:
+           every bucket from that depth down stores them with the same
+           layers, so ciphertexts and selections stop growing with the
+           height of the tree. A block moves down the tree by being
+           selected, stripped of its layers by the client and encrypted
+           again for the bucket it lands in, so no block ever needs more
+           layers than its bucket holds. A server given a storage layout
+           must get it from storage.encrypted_layout() with the same cap."""
+        assert max_onion_layers is None or max_onion_layers >= 1
         self.root_plain_space = root_plain_space
         self.public_key = public_key
         self.private_key = private_key
         self.chunks_per_block = chunks_per_block
         self.blocks_per_bucket = blocks_per_bucket
-        self.server = Server(total_levels, blocks_per_bucket,
-                             chunks_per_block)
+        if server is None:
+            server = Server(total_levels, blocks_per_bucket,
+                            chunks_per_block)
+        self.server = server
+        if metadata_codec is None:
+            metadata_codec = metadata.DamgardJurikCodec(public_key,
+                                                        private_key)
+        self.metadata_codec = metadata_codec
+        self.max_onion_layers = max_onion_layers
+
+        self._owns_executor = executor is None and workers is not None
+        if self._owns_executor:
+            executor = create_select_pool(public_key, workers)
+        self.executor = executor
+        self.workers = workers
+
+    def onion_layers(self, bucket_id):
+        return onion_layers(bucket_id, self.max_onion_layers)
+
+    def close(self):
+        if self._owns_executor:
+            self.executor.terminate()
+            self.executor.join()
+            self.executor = None
 
     def get_addresses(self, target):
-        buckets_, addresses_ = self.server.get_addresses(target)
-        buckets = copy.deepcopy(buckets_)
-        addresses = copy.deepcopy(addresses_)
-        for i in range(len(buckets)):
-            for j in range(self.blocks_per_bucket):
-                if addresses[i][j] < 0:
-                    continue
-                p = Payload(addresses[i][j], self.public_key, 1, 2)
-                addresses[i][j] = p.get_plaintext(self.private_key).payload
-        return buckets, addresses
+        buckets, addresses = self.server.get_addresses(target)
+        return buckets, self._decrypt_addresses(addresses)
 
-    def set_addresses(self, buckets, addresses):
-        for i in range(len(buckets)):
-            for j in range(self.blocks_per_bucket):
-                if addresses[i][j] < 0:
-                    continue
-                p = Payload(addresses[i][j], self.public_key, 1, 1).lift_once()
-                addresses[i][j] = p.payload
-        self.server.set_addresses(buckets, addresses)
+    def get_bucket_addresses(self, bucket_ids):
+        return self._decrypt_addresses(
+            self.server.get_bucket_addresses(bucket_ids))
 
-    def __onions(self, bucket_id):
-        res = 1
-        while bucket_id > 0:
-            bucket_id = (bucket_id - 1) / 2
-            res += 1
-        return res
+    def _decrypt_addresses(self, addresses):
+        decrypt = self.metadata_codec.decrypt
+        with instrumentation.phase('metadata_decryption'):
+            for i in range(len(addresses)):
+                for j in range(self.blocks_per_bucket):
+                    if addresses[i][j] >= 0:
+                        addresses[i][j] = decrypt(addresses[i][j])
+        return addresses
+
+    def set_addresses(self, buckets, addresses):
+        encrypt = self.metadata_codec.encrypt
+        self.server.set_addresses(buckets, [[x if x < 0 else encrypt(x)
+                                             for x in row]
+                                            for row in addresses])
 
     def select_block(self, bucket_ids, select_vector):
-        max_onion_layers = max([self.__onions(x) for x in bucket_ids])
-        max_onion_layers += self.root_plain_space
-        selectors = []
+        return self.select_blocks([(bucket_ids, select_vector)])[0]
+
+    def select_blocks(self, requests):
+        """Runs select_block(bucket_ids, select_vector) for every request;
+           with an executor all their chunks are selected in one pass over
+           the pool."""
+        # the dummy maps of all the requests' buckets, in one call
+        touched = sorted(set(bucket_id for bucket_ids, _ in requests
+                             for bucket_id in bucket_ids))
+        dummies = dict(zip(touched, self.server.dummy_map(touched)))
+        with instrumentation.phase('selector_encryption'):
+            prepared = [self._prepare_select(
+                bucket_ids, select_vector,
+                [dummies[bucket_id] for bucket_id in bucket_ids])
+                for bucket_ids, select_vector in requests]
+        with instrumentation.phase('homomorphic_select'):
+            selected = self.server.select_rows(self.public_key,
+                                               self.root_plain_space,
+                                               prepared, self.executor,
+                                               self.workers)
+        with instrumentation.phase('chunk_decryption'):
+            return [[Payload(x, self.public_key, self.root_plain_space,
+                             max(spaces) + 1).get_plaintext(
+                                 self.private_key).payload
+                     for x in chunks]
+                    for chunks, (_, _, spaces) in zip(selected, prepared)]
+
+    def _prepare_select(self, bucket_ids, select_vector, dummies):
+        candidates = []
+        bits = []
         for i in range(len(bucket_ids)):
-            bucket_id = bucket_ids[i]
             for j in range(self.blocks_per_bucket):
                 assert select_vector[i][j] in [0, 1]
-                if self.is_dummy(bucket_id, j):
+                if dummies[i][j]:
                     continue
-                p = Payload(select_vector[i][j], self.public_key,
-                            max_onion_layers, max_onion_layers).lift_once()
-                selectors.append(p)
-        selected_chunks = []
-        for c in range(self.chunks_per_block):
-            payloads = []
-            for i in range(len(bucket_ids)):
-                bucket_id = bucket_ids[i]
-                onion_layers = self.__onions(bucket_id)
-                for j in range(self.blocks_per_bucket):
-                    if self.is_dummy(bucket_id, j):
-                        continue
-                    data = self.server.buckets[bucket_id].blocks[j].chunks[c]
-                    chunk = Payload(data, self.public_key,
-                                    self.root_plain_space,
-                                    self.root_plain_space + onion_layers)
-                    payloads.append(chunk)
-            decrypted = homomorphic_select(payloads, selectors).get_plaintext(
-                self.private_key).payload
-            selected_chunks.append(decrypted)
-        return copy.deepcopy(selected_chunks)
+                bits.append(select_vector[i][j])
+                candidates.append((bucket_ids[i], j))
+
+        spaces = [self.root_plain_space + self.onion_layers(bucket_id)
+                  for bucket_id, _ in candidates]
+        max_space = max(spaces)
+        selectors = [Payload(bit, self.public_key, max_space,
+                             max_space).lift_once().payload
+                     for bit in bits]
+        return selectors, candidates, spaces
 
     def is_dummy(self, bucket_id, block_id):
-        return self.server.buckets[bucket_id].blocks[block_id].is_dummy()
+        return self.server.is_dummy(bucket_id, block_id)
 
-    def get_block(self, bucket_id, block_id):
-        block = copy.deepcopy(self.server.buckets[bucket_id].blocks[block_id])
-        metadata = self.get_metadata(bucket_id, block_id)
+    def dummy_map(self, bucket_ids):
+        return self.server.dummy_map(bucket_ids)
 
+    def get_bucket_metadata(self, bucket_ids):
+        """Per bucket, the get_metadata() of every slot, or None for a
+           dummy slot, fetched in one call."""
+        decrypt = self.metadata_codec.decrypt
+        rows = self.server.get_bucket_metadata(bucket_ids)
+        with instrumentation.phase('metadata_decryption'):
+            return [[None if entry is None else
+                     (decrypt(entry[0]), decrypt(entry[1]),
+                      self.server.chunks_per_block)
+                     for entry in row]
+                    for row in rows]
+
+    def get_block(self, bucket_id, block_id):
         # decrypt the metadata of this block
-        block.address = metadata[0]
-        block.bucket_leaf_target = metadata[1]
-        block.chunks_per_block = metadata[2]
+        address, bucket_leaf_target, chunks_per_block = \
+            self.get_metadata(bucket_id, block_id)
 
-        onion_layers = self.__onions(bucket_id)
+        space = self.root_plain_space + self.onion_layers(bucket_id)
         # decrypt all chunks of this block
-        for c in range(block.chunks_per_block):
-            p = Payload(block.chunks[c], self.public_key,
-                        self.root_plain_space,
-                        self.root_plain_space + onion_layers)
-            block.chunks[c] = p.get_plaintext(self.private_key).payload
-        return block
+        chunks = [Payload(x, self.public_key, self.root_plain_space,
+                          space).get_plaintext(self.private_key).payload
+                  for x in self.server.get_chunks(bucket_id,
+                                                  block_id)[:chunks_per_block]]
+        return Block(chunks_per_block, address, bucket_leaf_target, chunks)
 
     def get_metadata(self, bucket_id, block_id):
-        def remove_layer(data):
-            return Payload(data, self.public_key, 1, 2).get_plaintext(
-                self.private_key).payload
-
-        ref = self.server.buckets[bucket_id].blocks[block_id]
-        return remove_layer(ref.address), remove_layer(ref.bucket_leaf_target), \
+        address, bucket_leaf_target = self.server.get_metadata(bucket_id,
+                                                               block_id)
+        return self.metadata_codec.decrypt(address), \
+            self.metadata_codec.decrypt(bucket_leaf_target), \
             self.server.chunks_per_block
 
     def invalidate(self, bucket_id, block_id):
-        self.server.buckets[bucket_id].blocks[block_id].address = -1
-        self.server.buckets[bucket_id].blocks[block_id].chunks = None
-
-    def set_block(self, bucket_id, block_id, block_):
-        block = copy.deepcopy(block_)
+        self.server.invalidate(bucket_id, block_id)
 
-        def add_layer(data):
-            return Payload(data, self.public_key, 1, 1).lift_once().payload
+    def invalidate_blocks(self, slots):
+        self.server.invalidate_blocks(slots)
 
-        # encrypt the metadata of this block
-        block.address = add_layer(block.address)
-        block.bucket_leaf_target = add_layer(block.bucket_leaf_target)
+    def set_block(self, bucket_id, block_id, block):
+        self.set_blocks([(bucket_id, block_id, block)])
 
-        onion_layers = self.__onions(bucket_id)
-        # encrypt all chunks of this block
-        for c in range(block.chunks_per_block):
-            p = Payload(block.chunks[c], self.public_key,
-                        self.root_plain_space,
-                        self.root_plain_space).lift_by(onion_layers)
-            block.chunks[c] = p.payload
+    def set_blocks(self, writes):
+        """Runs set_block(bucket_id, block_id, block) for every write; with
+           an executor the blocks are encrypted in parallel."""
+        tasks = [(self.root_plain_space, self.onion_layers(bucket_id),
+                  block.chunks[:block.chunks_per_block])
+                 for bucket_id, _, block in writes]
+        with instrumentation.phase('reencryption'):
+            if self.executor is None:
+                encrypted = [_encrypt_chunks(self.public_key, *task)
+                             for task in tasks]
+            else:
+                encrypted = self.executor.map(_encrypt_chunks_in_worker,
+                                              tasks)
 
-        self.server.buckets[bucket_id].blocks[block_id] = block
+        encrypt = self.metadata_codec.encrypt
+        self.server.set_blocks([(bucket_id, block_id, Block(
+            block.chunks_per_block, encrypt(block.address),
+            encrypt(block.bucket_leaf_target), chunks))
+            for (bucket_id, block_id, block), chunks in zip(writes,
+                                                            encrypted)])
 
 
 class NonEncServerWrapper(object):
-    def __init__(self, total_levels, blocks_per_bucket, chunks_per_block):
-        self.server = Server(total_levels, blocks_per_bucket, chunks_per_block)
+    def __init__(self, total_levels, blocks_per_bucket, chunks_per_block,
+                 server=None):
+        if server is None:
+            server = Server(total_levels, blocks_per_bucket,
+                            chunks_per_block)
+        self.server = server
         self.chunks_per_block = chunks_per_block
 
     def get_addresses(self, target):
         return self.server.get_addresses(target)
 
+    def get_bucket_addresses(self, bucket_ids):
+        return self.server.get_bucket_addresses(bucket_ids)
+
     def set_addresses(self, buckets, addresses):
         self.server.set_addresses(buckets, addresses)
 
@@ -220,38 +474,184 @@ class NonEncServerWrapper(object):
         occurances = 0
         chunks = None
         for i in range(len(bucket_ids)):
-            bucket = self.server.buckets[bucket_ids[i]]
             for block_id in range(blocks_per_bucket):
                 selected = select_vector[i][block_id]
                 assert (selected >= 0 and selected <= 1)
                 if selected > 0:
                     occurances += 1
-                    chunks = bucket.blocks[block_id].chunks
+                    chunks = self.server.get_chunks(bucket_ids[i], block_id)
         assert occurances == 1
-        return copy.deepcopy(chunks)
+        return list(chunks)
+
+    def select_blocks(self, requests):
+        return [self.select_block(bucket_ids, select_vector)
+                for bucket_ids, select_vector in requests]
 
     def is_dummy(self, bucket_id, block_id):
-        return self.server.buckets[bucket_id].blocks[block_id].is_dummy()
+        return self.server.is_dummy(bucket_id, block_id)
 
     def get_block(self, bucket_id, block_id):
-        return copy.deepcopy(self.server.buckets[bucket_id].blocks[block_id])
+        return self.server.get_block(bucket_id, block_id)
 
     def get_metadata(self, bucket_id, block_id):
-        ref = self.server.buckets[bucket_id].blocks[block_id]
-        return ref.address, ref.bucket_leaf_target, ref.chunks_per_block
+        block = self.server.get_block(bucket_id, block_id)
+        return block.address, block.bucket_leaf_target, block.chunks_per_block
+
+    def dummy_map(self, bucket_ids):
+        return self.server.dummy_map(bucket_ids)
+
+    def get_bucket_metadata(self, bucket_ids):
+        return [[None if entry is None else
+                 (entry[0], entry[1], self.chunks_per_block)
+                 for entry in row]
+                for row in self.server.get_bucket_metadata(bucket_ids)]
 
     def invalidate(self, bucket_id, block_id):
-        self.server.buckets[bucket_id].blocks[block_id].address = -1
-        self.server.buckets[bucket_id].blocks[block_id].chunks = None
+        self.server.invalidate(bucket_id, block_id)
+
+    def invalidate_blocks(self, slots):
+        self.server.invalidate_blocks(slots)
+
+    def set_block(self, bucket_id, block_id, block):
+        self.set_blocks([(bucket_id, block_id, block)])
+
+    @staticmethod
+    def _snapshot(block):
+        # the chunks may still belong to the caller, so the stored block
+        # gets an immutable snapshot of them; dummy blocks have none
+        chunks = getattr(block, 'chunks', None)
+        if chunks is not None:
+            chunks = tuple(chunks)
+        return Block(block.chunks_per_block, block.address,
+                     block.bucket_leaf_target, chunks)
+
+    def set_blocks(self, writes):
+        self.server.set_blocks([(bucket_id, block_id, self._snapshot(block))
+                                for bucket_id, block_id, block in writes])
+
+
+class MetadataCache(object):
+    """Wraps a server wrapper and keeps the decrypted addresses of the
+       buckets in its top levels, which every path shares. Rows are loaded
+       the first time they are read and then kept up to date with the
+       writes that go through this cache, so everything must access the
+       tree through it. Loading a row and writing a bucket hold the same
+       lock, so a row read by another thread, e.g. the prefetch of a
+       pipeline.AsyncClient, is never cached after a newer write. Either
+       levels is given, or the largest number of levels whose rows fit in
+       memory_budget bytes is used."""
+    # estimated bytes per cached address: a list slot and a small integer
+    ENTRY_BYTES = 32
+
+    def __init__(self, server_wrapper, total_levels, blocks_per_bucket,
+                 levels=None, memory_budget=None):
+        self.server_wrapper = server_wrapper
+        self.total_levels = total_levels
+        self.blocks_per_bucket = blocks_per_bucket
+        if levels is None:
+            levels = self.levels_for_budget(total_levels, blocks_per_bucket,
+                                            memory_budget or 0)
+        self.levels = min(levels, total_levels + 1)
+        # buckets below this id are cached
+        self.cached_buckets = (1 << self.levels) - 1
+        self.rows = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def levels_for_budget(cls, total_levels, blocks_per_bucket,
+                          memory_budget):
+        levels = 0
+        while (levels <= total_levels and
+               ((1 << (levels + 1)) - 1) * blocks_per_bucket *
+               cls.ENTRY_BYTES <= memory_budget):
+            levels += 1
+        return levels
+
+    def __getattr__(self, name):
+        return getattr(self.server_wrapper, name)
+
+    def get_addresses(self, target):
+        buckets = path_bucket_ids(self.total_levels, target)
+        return buckets, self.get_bucket_addresses(buckets)
+
+    def get_bucket_addresses(self, bucket_ids):
+        with self.lock:
+            return self._get_bucket_addresses(bucket_ids)
+
+    def _get_bucket_addresses(self, bucket_ids):
+        missing = [bucket_id for bucket_id in bucket_ids
+                   if bucket_id not in self.rows]
+        fetched = {}
+        if len(missing) > 0:
+            fetched = dict(zip(missing, self.server_wrapper.
+                               get_bucket_addresses(missing)))
+            self.misses += len(missing)
+        self.hits += len(bucket_ids) - len(missing)
+        addresses = []
+        for bucket_id in bucket_ids:
+            if bucket_id in fetched:
+                row = fetched[bucket_id]
+                if bucket_id < self.cached_buckets:
+                    self.rows[bucket_id] = list(row)
+            else:
+                # the caller owns the returned rows
+                row = list(self.rows[bucket_id])
+            addresses.append(row)
+        return addresses
+
+    def is_dummy(self, bucket_id, block_id):
+        if bucket_id in self.rows:
+            return self.rows[bucket_id][block_id] < 0
+        return self.server_wrapper.is_dummy(bucket_id, block_id)
+
+    def dummy_map(self, bucket_ids):
+        missing = [bucket_id for bucket_id in bucket_ids
+                   if bucket_id not in self.rows]
+        fetched = {}
+        if len(missing) > 0:
+            fetched = dict(zip(missing,
+                               self.server_wrapper.dummy_map(missing)))
+        return [fetched[bucket_id] if bucket_id in fetched
+                else [address < 0 for address in self.rows[bucket_id]]
+                for bucket_id in bucket_ids]
+
+    def set_addresses(self, buckets, addresses):
+        with self.lock:
+            for bucket_id, row in zip(buckets, addresses):
+                if bucket_id in self.rows:
+                    self.rows[bucket_id] = list(row)
+            self.server_wrapper.set_addresses(buckets, addresses)
 
     def set_block(self, bucket_id, block_id, block):
-        self.server.buckets[bucket_id].blocks[block_id] = copy.deepcopy(block)
+        self.set_blocks([(bucket_id, block_id, block)])
+
+    def set_blocks(self, writes):
+        with self.lock:
+            for bucket_id, block_id, block in writes:
+                if bucket_id in self.rows:
+                    self.rows[bucket_id][block_id] = block.address
+            self.server_wrapper.set_blocks(writes)
+
+    def invalidate(self, bucket_id, block_id):
+        self.invalidate_blocks([(bucket_id, block_id)])
+
+    def invalidate_blocks(self, slots):
+        with self.lock:
+            for bucket_id, block_id in slots:
+                if bucket_id in self.rows:
+                    self.rows[bucket_id][block_id] = -1
+            self.server_wrapper.invalidate_blocks(slots)
 
 
 class Client(object):
     def __init__(self, total_levels, total_blocks, blocks_per_bucket,
                  chunks_per_block, eviction_period, server_wrapper,
-                 public_key=None, private_key=None):
+                 public_key=None, private_key=None, position_map=None):
+        """position_map replaces the default list of leaf targets, e.g.
+           with a position_map.PackedPositionMap of total_blocks entries,
+           all -1."""
         self.public_key = public_key
         self.private_key = private_key
 
@@ -262,12 +662,43 @@ class Client(object):
         self.chunks_per_block = chunks_per_block
         self.eviction_period = eviction_period
         self.server_wrapper = server_wrapper
+        # (server wrapper, server) to restore when instrumentation stops
+        self._measured = None
 
         self.eviction_counter = 0
         self.next_evicted_path = 0
 
         # initilize the position map with -1 which indicate invalid blocks
-        self.position_map = [-1 for _ in range(self.total_blocks)]
+        if position_map is None:
+            position_map = [-1 for _ in range(self.total_blocks)]
+        assert len(position_map) == self.total_blocks
+        self.position_map = position_map
+        # the blocks written so far, in order, and a flag per block, so
+        # that access_many() can tell and pick them without reading the
+        # position map
+        self.written_blocks = []
+        self.written = bytearray(self.total_blocks)
+
+    def enable_instrumentation(self, trace=False):
+        """Starts recording counters and phase timings, see
+           instrumentation.py, including the bytes that the server wrapper
+           exchanges with its server. Returns the Recorder."""
+        server_wrapper = self.server_wrapper
+        while hasattr(server_wrapper, 'server_wrapper'):
+            server_wrapper = server_wrapper.server_wrapper
+        if hasattr(server_wrapper, 'server') and self._measured is None:
+            self._measured = (server_wrapper,
+                              instrumentation.measure_server(server_wrapper))
+        return instrumentation.enable(trace)
+
+    def disable_instrumentation(self):
+        """Stops recording and takes the byte meter out of the server
+           path again. Returns the Recorder."""
+        if self._measured is not None:
+            server_wrapper, server = self._measured
+            server_wrapper.server = server
+            self._measured = None
+        return instrumentation.disable()
 
     def __is_parent(self, parent, child):
         if parent == 0:
@@ -276,58 +707,107 @@ class Client(object):
             child = (child - 1) / 2
         return child == parent
 
-    def _push(self, source):
-        assert source >= 0
-        assert source < (1 << self.total_levels) - 1
-        child = [source * 2 + 1, source * 2 + 2]
-        next_index = [0, 0]
-        for block_index in range(self.blocks_per_bucket):
-            if self.server_wrapper.is_dummy(source, block_index):
-                continue
-            address, bucket_leaf_target, _ = \
-                self.server_wrapper.get_metadata(source, block_index)
-            target = (1 << self.total_levels) - 1 + bucket_leaf_target
-            assert (self.__is_parent(child[0], target) ^
-                    self.__is_parent(child[1], target))
-            goesto = 0 if self.__is_parent(child[0], target) else 1
-            assert self.__is_parent(child[goesto], target)
-            while (next_index[goesto] < self.blocks_per_bucket and
-                   not self.server_wrapper.is_dummy(child[goesto],
-                                                    next_index[goesto])):
+    def _plan_eviction(self, nodes_along_path):
+        """Plans every move of an eviction along nodes_along_path from the
+           metadata alone, in the order the buckets are pushed root to leaf.
+           The moves are grouped in waves: a move only depends on the move
+           that brought the same block into its source bucket, which always
+           sits in the previous wave."""
+        # the metadata of every source bucket and the dummy map of every
+        # other child, each fetched with one call
+        sources = nodes_along_path[: -1]
+        metadata = dict(zip(sources,
+                            self.server_wrapper.get_bucket_metadata(sources)))
+        others = [child for source in sources
+                  for child in [source * 2 + 1, source * 2 + 2]
+                  if child not in metadata]
+        dummies = dict(zip(others, self.server_wrapper.dummy_map(others)))
+        for source in sources:
+            dummies[source] = [entry is None for entry in metadata[source]]
+
+        # (slot, address, bucket_leaf_target, wave) of the blocks that will
+        # sit in the next source bucket when it is pushed
+        arriving = []
+        waves = []
+        for source in sources:
+            assert source >= 0
+            assert source < (1 << self.total_levels) - 1
+            child = [source * 2 + 1, source * 2 + 2]
+            residents = []
+            for block_index, entry in enumerate(metadata[source]):
+                if entry is None:
+                    continue
+                address, bucket_leaf_target, _ = entry
+                residents.append((block_index, address,
+                                  bucket_leaf_target, 0))
+            free_slots = [[j for j in range(self.blocks_per_bucket)
+                           if dummies[child[k]][j]]
+                          for k in range(2)]
+            next_index = [0, 0]
+            next_arriving = []
+            for block_index, address, bucket_leaf_target, wave in \
+                    sorted(residents + arriving):
+                target = (1 << self.total_levels) - 1 + bucket_leaf_target
+                assert (self.__is_parent(child[0], target) ^
+                        self.__is_parent(child[1], target))
+                goesto = 0 if self.__is_parent(child[0], target) else 1
+                if next_index[goesto] == len(free_slots[goesto]):
+                    raise RuntimeError("Not enough room for eviction.")
+                destination_slot = free_slots[goesto][next_index[goesto]]
                 next_index[goesto] += 1
-            if next_index[goesto] == self.blocks_per_bucket:
-                raise RuntimeError("Not enough room for eviction.")
-            buckets = [source, child[goesto]]
-            select_vector = [[0] * self.blocks_per_bucket,
-                             [0] * self.blocks_per_bucket]
-            select_vector[0][block_index] = 1
-            chunks = self.server_wrapper.select_block(buckets, select_vector)
-            new_block = Block(self.chunks_per_block, address,
-                              bucket_leaf_target, chunks)
-            self.server_wrapper.set_block(child[goesto],
-                                          next_index[goesto],
-                                          new_block)
-            next_index[goesto] += 1
-            self.server_wrapper.invalidate(source, block_index)
+                while len(waves) <= wave:
+                    waves.append([])
+                waves[wave].append((source, block_index, child[goesto],
+                                    destination_slot, address,
+                                    bucket_leaf_target))
+                if child[goesto] in nodes_along_path:
+                    next_arriving.append((destination_slot, address,
+                                          bucket_leaf_target, wave + 1))
+            arriving = next_arriving
+        return waves
 
     def _evict_along_path(self, leaf_target):
-        at = leaf_target + (1 << self.total_levels) - 1
+        nodes_along_path = path_bucket_ids(self.total_levels, leaf_target)
+        with instrumentation.phase('eviction_plan'):
+            waves = self._plan_eviction(nodes_along_path)
+        if instrumentation.active is not None:
+            instrumentation.active.add_eviction(sum(map(len, waves)))
+        # all moves of a wave are independent, so their selections and
+        # re-encryptions are handed to the server wrapper as one batch
+        for wave in waves:
+            requests = []
+            for source, block_index, destination, _, _, _ in wave:
+                select_vector = [[0] * self.blocks_per_bucket,
+                                 [0] * self.blocks_per_bucket]
+                select_vector[0][block_index] = 1
+                requests.append(([source, destination], select_vector))
+            selected = self.server_wrapper.select_blocks(requests)
+            writes = []
+            for (_, _, destination, destination_slot, address,
+                 bucket_leaf_target), chunks in zip(wave, selected):
+                new_block = Block(self.chunks_per_block, address,
+                                  bucket_leaf_target, chunks)
+                writes.append((destination, destination_slot, new_block))
+            self.server_wrapper.set_blocks(writes)
+            self.server_wrapper.invalidate_blocks(
+                [(source, block_index)
+                 for source, block_index, _, _, _, _ in wave])
 
-        nodes_along_path = []
-        for _ in range(self.total_levels + 1):
-            nodes_along_path.append(at)
-            at = (at - 1) / 2
-
-        nodes_along_path.reverse()
-        for source in nodes_along_path[: -1]:
-            self._push(source)
+    def _mark_written(self, block_id):
+        self.written[block_id] = 1
+        self.written_blocks.append(block_id)
 
     def _initialize_block(self, block_id):
-        assert self.position_map[block_id] < 0
+        assert not self.written[block_id]
+        # the dummy maps of the buckets drawn so far
+        dummies = {}
         while True:
             _bucket_id = random.randint(1, self.total_leaf_buckets * 2 - 2)
             _block_id = random.randint(0, self.blocks_per_bucket - 1)
-            if self.server_wrapper.is_dummy(_bucket_id, _block_id):
+            if _bucket_id not in dummies:
+                dummies[_bucket_id] = \
+                    self.server_wrapper.dummy_map([_bucket_id])[0]
+            if dummies[_bucket_id][_block_id]:
                 target = _bucket_id
                 while target * 2 + 2 < self.total_leaf_buckets * 2 - 1:
                     target = target * 2 + random.randint(1, 2)
@@ -341,57 +821,262 @@ class Client(object):
                 block.chunks = [0] * self.server_wrapper.chunks_per_block
                 self.server_wrapper.set_block(_bucket_id, _block_id, block)
                 self.position_map[block_id] = target
+                self._mark_written(block_id)
                 break
 
+    def bulk_load(self, blocks):
+        """Writes every (block_id, chunks) of blocks, none of which may have
+           been written before, in one streaming pass: every block gets a
+           random leaf and a slot on its path below the root, as deep as
+           possible while a quarter of every bucket stays free, see
+           _load_level(). The buckets are then written level by level, each
+           level with one set_blocks() call, whose encryptions run in
+           parallel on a pool.
+           Returns the number of blocks loaded."""
+        free_slots = {}
+        levels = [[] for _ in range(self.total_levels + 1)]
+        loaded = []
+        reserve = self.blocks_per_bucket / 4
+        try:
+            for block_id, chunks in blocks:
+                assert (block_id >= 0 and block_id < self.total_blocks)
+                if self.written[block_id]:
+                    raise RuntimeError("Block " + str(block_id) +
+                                       " was written before.")
+                leaf_target = random.randint(0, self.total_leaf_buckets - 1)
+                path = path_bucket_ids(self.total_levels, leaf_target)
+                missing = [bucket_id for bucket_id in path[1:]
+                           if bucket_id not in free_slots]
+                if len(missing) > 0:
+                    addresses = self.server_wrapper.get_bucket_addresses(
+                        missing)
+                    for bucket_id, row in zip(missing, addresses):
+                        free_slots[bucket_id] = [j for j in range(len(row))
+                                                 if row[j] < 0]
+                level = self._load_level(path, free_slots, reserve)
+                if level == 0:
+                    raise RuntimeError("Not enough room to load block " +
+                                       str(block_id) + ".")
+                slot = free_slots[path[level]].pop(0)
+                levels[level].append((path[level], slot, Block(
+                    self.chunks_per_block, block_id, leaf_target,
+                    list(chunks))))
+                self.position_map[block_id] = leaf_target
+                self._mark_written(block_id)
+                loaded.append(block_id)
+        except Exception:
+            # nothing has been written yet
+            for block_id in loaded:
+                self.position_map[block_id] = -1
+                self.written[block_id] = 0
+            del self.written_blocks[len(self.written_blocks) - len(loaded):]
+            raise
+
+        for writes in levels:
+            if len(writes) > 0:
+                writes.sort(key=lambda write: write[:2])
+                self.server_wrapper.set_blocks(writes)
+        return len(loaded)
+
+    @staticmethod
+    def _load_level(path, free_slots, reserve):
+        """The deepest level of path, below the root, whose bucket has more
+           than reserve free slots, so that the first evictions find room
+           in every bucket; failing that the deepest with any free slot,
+           and 0 if there is none."""
+        for minimum in [reserve, 0]:
+            for level in range(len(path) - 1, 0, -1):
+                if len(free_slots[path[level]]) > minimum:
+                    return level
+        return 0
+
     def access(self, block_id, operation, new_chunks=None):
         assert (block_id >= 0 and block_id < self.total_blocks)
-        if (self.position_map[block_id] < 0 and operation == Operations.WRITE):
+        if operation == Operations.WRITE:
+            self._access(block_id, new_chunks)
+            return None
+        return self._access(block_id)
+
+    def _access(self, block_id, new_chunks=None, path=None):
+        """One ORAM access: returns the chunks of block_id and, unless
+           new_chunks is None, replaces them. path is the result of
+           get_addresses() for the block's current leaf, if the caller
+           already has it."""
+        if not self.written[block_id] and new_chunks is not None:
             self._initialize_block(block_id)
-        if self.position_map[block_id] < 0:
+        if not self.written[block_id]:
             raise RuntimeError("Trying to access block not written before.")
 
         new_bucket_leaf_target = random.randint(0, self.total_leaf_buckets - 1)
         leaf_target = self.position_map[block_id]
         self.position_map[block_id] = new_bucket_leaf_target
 
-        bucket_ids_, addresses_ = self.server_wrapper.get_addresses(leaf_target)
-        bucket_ids = copy.deepcopy(bucket_ids_)
-        addresses = copy.deepcopy(addresses_)
-        select_vector = copy.deepcopy(addresses)
-        counter = {}
-        matches = 0
-        for i in range(len(addresses)):
-            for j in range(self.blocks_per_bucket):
-                if addresses[i][j] not in counter:
-                    counter[addresses[i][j]] = 0
-                counter[addresses[i][j]] += 1
-                if counter[addresses[i][j]] > 1 and addresses[i][j] >= 0:
-                    raise RuntimeError("duplicate blocks")
-                select_vector[i][j] = 0
-                if addresses[i][j] == block_id:
-                    select_vector[i][j] = 1
-                    addresses[i][j] = -1
-                    matches += 1
+        recorder = instrumentation.active
+        if recorder is not None:
+            recorder.begin_access(block_id)
+        # the wrapper hands over fresh rows, which are ours to modify
+        if path is None:
+            with instrumentation.phase('metadata'):
+                path = self.server_wrapper.get_addresses(leaf_target)
+        bucket_ids, addresses = path
+        with instrumentation.phase('scan'):
+            select_vector, addresses, matches = scan_path(addresses,
+                                                          block_id)
         assert matches == 1
-        chunks = self.server_wrapper.select_block(bucket_ids, select_vector)
-        if operation == Operations.WRITE:
-            chunks = new_chunks
+        with instrumentation.phase('select'):
+            chunks = self.server_wrapper.select_block(bucket_ids,
+                                                      select_vector)
         # invalidates the old bucket by resetting all the metadata
-        self.server_wrapper.set_addresses(bucket_ids, addresses)
+        with instrumentation.phase('set_addresses'):
+            self.server_wrapper.set_addresses(bucket_ids, addresses)
 
         new_block = Block(self.chunks_per_block, block_id,
-                          new_bucket_leaf_target, chunks)
-        self.server_wrapper.set_block(0, self.eviction_counter, new_block)
+                          new_bucket_leaf_target,
+                          chunks if new_chunks is None else new_chunks)
+        with instrumentation.phase('root_write'):
+            self.server_wrapper.set_block(0, self.eviction_counter,
+                                          new_block)
+        self._count_root_writes(1)
+        if recorder is not None:
+            recorder.end_access()
+
+        return chunks
 
-        self.eviction_counter += 1
+    def _count_root_writes(self, count):
+        """Accounts for count blocks written to the root, evicting a path
+           once eviction_period of them have been written."""
+        self.eviction_counter += count
         if self.eviction_counter == self.eviction_period:
             self.eviction_counter = 0
-            self._evict_along_path(
-                utils.bitreverse(self.next_evicted_path, self.total_levels))
+            with instrumentation.phase('eviction'):
+                self._evict_along_path(utils.bitreverse(
+                    self.next_evicted_path, self.total_levels))
             self.next_evicted_path = self.next_evicted_path + 1
             if self.next_evicted_path >= self.total_blocks:
                 self.next_evicted_path -= self.total_blocks
 
-        if operation == Operations.READ:
-            return chunks
-        return None
+    def access_many(self, requests):
+        """Runs access(block_id, operation, new_chunks) for every request
+           and returns their results, in order. The accesses to a block are
+           served by one ORAM access; to keep the number of accesses
+           independent of the repetitions, the batch is padded with accesses
+           to random other blocks. Between evictions, all the paths'
+           metadata is read and written in one call and all the blocks are
+           selected in one batch. The position map is only read for the
+           blocks accessed, once each, so that with a RecursivePositionMap
+           its own accesses do not depend on which blocks were asked for."""
+        groups = []
+        by_block = {}
+        for block_id, operation, new_chunks in requests:
+            assert (block_id >= 0 and block_id < self.total_blocks)
+            if block_id not in by_block:
+                if (not self.written[block_id] and
+                        operation != Operations.WRITE):
+                    raise RuntimeError("Trying to access block not written "
+                                       "before.")
+                by_block[block_id] = []
+                groups.append(block_id)
+            by_block[block_id].append((operation, new_chunks))
+
+        # a random sample of the written blocks, large enough to keep
+        # enough of them once the requested blocks are left out
+        missing = len(requests) - len(groups)
+        sample = random.sample(self.written_blocks,
+                               min(len(self.written_blocks),
+                                   missing + len(groups)))
+        padding = [block_id for block_id in sample
+                   if block_id not in by_block][:missing]
+        for block_id in groups:
+            if not self.written[block_id]:
+                self._initialize_block(block_id)
+        block_ids = groups + padding
+        random.shuffle(block_ids)
+
+        contents = {}
+        start = 0
+        while start < len(block_ids):
+            count = len(block_ids) - start
+            if self.eviction_period > 0:
+                count = min(count,
+                            self.eviction_period - self.eviction_counter)
+            batch = block_ids[start: start + count]
+            start += count
+            for block_id, chunks in zip(batch, self._access_batch(
+                    batch, by_block)):
+                contents[block_id] = chunks
+
+        results = []
+        for block_id, operation, new_chunks in requests:
+            if operation == Operations.WRITE:
+                contents[block_id] = new_chunks
+                results.append(None)
+            else:
+                results.append(list(contents[block_id]))
+        return results
+
+    def _access_batch(self, block_ids, operations):
+        """Accesses block_ids, which fit in the root before the next
+           eviction, and returns their chunks. The last write in
+           operations[block_id], if any, replaces the chunks of a block."""
+        recorder = instrumentation.active
+        if recorder is not None:
+            recorder.begin_batch(block_ids)
+        paths = []
+        new_leaf_targets = []
+        bucket_ids = []
+        seen = set()
+        for block_id in block_ids:
+            path = path_bucket_ids(self.total_levels,
+                                   self.position_map[block_id])
+            paths.append(path)
+            for bucket_id in path:
+                if bucket_id not in seen:
+                    seen.add(bucket_id)
+                    bucket_ids.append(bucket_id)
+            new_leaf_targets.append(
+                random.randint(0, self.total_leaf_buckets - 1))
+            self.position_map[block_id] = new_leaf_targets[-1]
+
+        with instrumentation.phase('metadata'):
+            addresses = self.server_wrapper.get_bucket_addresses(bucket_ids)
+        # where every block sits, as (bucket index, slot)
+        found = {}
+        for i in range(len(bucket_ids)):
+            for j in range(self.blocks_per_bucket):
+                address = addresses[i][j]
+                if address < 0:
+                    continue
+                if address in found:
+                    raise RuntimeError("duplicate blocks")
+                found[address] = (i, j)
+
+        requests = []
+        for block_id, path in zip(block_ids, paths):
+            assert block_id in found
+            i, j = found[block_id]
+            assert bucket_ids[i] in path
+            select_vector = [[0] * self.blocks_per_bucket for _ in path]
+            select_vector[path.index(bucket_ids[i])][j] = 1
+            requests.append((path, select_vector))
+            addresses[i][j] = -1
+        with instrumentation.phase('select'):
+            selected = self.server_wrapper.select_blocks(requests)
+        # invalidates the old buckets by resetting all the metadata
+        with instrumentation.phase('set_addresses'):
+            self.server_wrapper.set_addresses(bucket_ids, addresses)
+
+        root_writes = []
+        for k, (block_id, chunks) in enumerate(zip(block_ids, selected)):
+            new_chunks = [c for operation, c in operations.get(block_id, [])
+                          if operation == Operations.WRITE]
+            if len(new_chunks) > 0:
+                chunks = new_chunks[-1]
+            root_writes.append((0, self.eviction_counter + k, Block(
+                self.chunks_per_block, block_id, new_leaf_targets[k],
+                chunks)))
+        with instrumentation.phase('root_write'):
+            self.server_wrapper.set_blocks(root_writes)
+        self._count_root_writes(len(block_ids))
+        if recorder is not None:
+            recorder.end_access()
+        return selected
@@ -1,10 +1,15 @@
-import copy
 import random
 import string
 import utils
 
 VERBOSE_DEBUGGING = False
 
+# Buckets and blocks are passed between the client and the server by
+# reference: a server keeps what it is given, and stored blocks are never
+# modified in place, only replaced. With CHECK_ALIASING, everything a server
+# stores is frozen, so that breaking this rule raises right away.
+CHECK_ALIASING = False
+
 Operations = utils.enum(READ=1, WRITE=2)
 
 
@@ -28,15 +33,41 @@ class Block(object):
         self.address = -1
         self.leaf_target = -1
 
+    def invalidated(self):
+        return Block(-1, -1, self.contents)
+
+    def freeze(self):
+        self.__class__ = FrozenBlock
+        return self
+
     def __str__(self):
         return ("address = " + str(self.address) + ", leaf_target= " +
                 str(self.leaf_target) + "sign: " + self.contents)
 
 
+class FrozenBlock(Block):
+    def __setattr__(self, name, value):
+        raise AttributeError("Trying to modify a block owned by a server.")
+
+    def freeze(self):
+        return self
+
+
 class Bucket(object):
     def __init__(self, blocks_per_bucket):
         self.blocks = [Block() for _ in range(blocks_per_bucket)]
 
+    def copy(self):
+        """A new bucket sharing this bucket's blocks, which is safe since
+           blocks are replaced rather than modified."""
+        bucket = Bucket(0)
+        bucket.blocks = list(self.blocks)
+        return bucket
+
+    def freeze(self):
+        self.blocks = tuple(block.freeze() for block in self.blocks)
+        return self
+
     def get_valid_blocks(self):
         free_slots = []
         valid_blocks = []
@@ -48,8 +79,7 @@ class Bucket(object):
         return free_slots, valid_blocks
 
     def invalidate_all(self):
-        for block in self.blocks:
-            block.invalidate()
+        self.blocks = [block.invalidated() for block in self.blocks]
 
 
 class Server(object):
@@ -86,20 +116,30 @@ class Server(object):
         if VERBOSE_DEBUGGING:
             print "invalidating: ", \
                 self.buckets[bucket_id].blocks[block_id].address
-        self.buckets[bucket_id].blocks[block_id].invalidate()
-        return self.buckets[bucket_id].blocks[block_id].contents
+        block = self.buckets[bucket_id].blocks[block_id]
+        self.set_block(bucket_id, block_id, block.invalidated())
+        return block.contents
 
     def get_bucket(self, bucket_id):
-        return copy.deepcopy(self.buckets[bucket_id])
+        return self.buckets[bucket_id].copy()
 
     def set_bucket(self, bucket_id, bucket):
-        self.buckets[bucket_id] = copy.deepcopy(bucket)
+        if CHECK_ALIASING:
+            bucket.freeze()
+        self.buckets[bucket_id] = bucket
 
     def get_block(self, bucket_id, block_id):
-        return copy.deepcopy(self.buckets[bucket_id].blocks[block_id])
+        return self.buckets[bucket_id].blocks[block_id]
 
     def set_block(self, bucket_id, block_id, block):
-        self.buckets[bucket_id].blocks[block_id] = copy.deepcopy(block)
+        bucket = self.buckets[bucket_id]
+        if CHECK_ALIASING:
+            # stored buckets are frozen, so replace the bucket itself
+            bucket = bucket.copy()
+            bucket.blocks[block_id] = block
+            self.set_bucket(bucket_id, bucket)
+        else:
+            bucket.blocks[block_id] = block
 
     def traverse(self):
         if VERBOSE_DEBUGGING:
@@ -172,21 +212,28 @@ class Client(object):
         return child == parent
 
     def __bootstrap(self):
-        block = 0
-        while block < self.total_blocks:
-            bucket_id = random.randint(1, self.total_blocks * 2 - 2)
-            block_id = random.randint(0, self.blocks_per_bucket - 1)
-            if not self.server.get_block(bucket_id, block_id).is_valid():
-                target = bucket_id
-                while target * 2 + 2 < self.total_blocks * 2 - 1:
-                    target = target * 2 + random.randint(1, 2)
-                target -= self.total_blocks - 1
-                corresponding_leaf = target + self.total_blocks - 1
-                assert self.__is_parent(bucket_id, corresponding_leaf)
-                new_block = Block(block, target, "anastaso")
-                self.server.set_block(bucket_id, block_id, new_block)
-                self.position_map[block] = target
-                block += 1
+        # draw the slots without replacement from a list of the free ones,
+        # rather than probing random slots, which slows down as they fill
+        free_slots = [(bucket_id, block_id)
+                      for bucket_id in range(1, self.total_blocks * 2 - 1)
+                      for block_id in range(self.blocks_per_bucket)
+                      if not self.server.get_block(bucket_id,
+                                                   block_id).is_valid()]
+        for block in range(self.total_blocks):
+            if len(free_slots) == 0:
+                raise RuntimeError("Not enough room for the blocks.")
+            k = random.randint(0, len(free_slots) - 1)
+            free_slots[k], free_slots[-1] = free_slots[-1], free_slots[k]
+            bucket_id, block_id = free_slots.pop()
+            target = bucket_id
+            while target * 2 + 2 < self.total_blocks * 2 - 1:
+                target = target * 2 + random.randint(1, 2)
+            target -= self.total_blocks - 1
+            corresponding_leaf = target + self.total_blocks - 1
+            assert self.__is_parent(bucket_id, corresponding_leaf)
+            new_block = Block(block, target, "anastaso")
+            self.server.set_block(bucket_id, block_id, new_block)
+            self.position_map[block] = target
 
     def __push(self, source):
         assert source >= 0
@@ -220,7 +267,7 @@ class Client(object):
             chosen = random.sample(population, len(place))
             for i, x in enumerate(chosen):
                 assert not bucket.blocks[x].is_valid()
-                bucket.blocks[x] = copy.deepcopy(place[i])
+                bucket.blocks[x] = place[i]
 
         source_bucket.invalidate_all()
         self.server.set_bucket(source, source_bucket)
@@ -0,0 +1,49 @@
+"""The metadata scan at the start of every onion_oram.Client access.
+
+Given the address rows of a path, scan_path() checks that no block
+appears twice, finds the requested block, and builds the select vector.
+Rows that come as one int64 NumPy array, as from
+numpy_tier.NumpyServerWrapper, are scanned with array operations and the
+results stay arrays; rows that come as lists are scanned with list
+operations, which still run in C. Converting between the two costs more
+than the array scan saves, so neither is turned into the other."""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def scan_path(addresses, block_id):
+    """Returns (select_vector, addresses, matches): select_vector has a 1
+       where block_id sits, addresses are the rows with that slot reset to
+       -1 and matches counts the slots that held block_id. Raises
+       RuntimeError if a block appears twice. The rows are modified in
+       place; with an array the select vector is an array too."""
+    if numpy is not None and isinstance(addresses, numpy.ndarray):
+        return _scan_array(addresses, block_id)
+    return _scan_lists(addresses, block_id)
+
+
+def _scan_array(addresses, block_id):
+    real = addresses[addresses >= 0]
+    if len(numpy.unique(real)) != len(real):
+        raise RuntimeError("duplicate blocks")
+    match = addresses == block_id
+    addresses[match] = -1
+    return match.astype(numpy.int64), addresses, int(match.sum())
+
+
+def _scan_lists(addresses, block_id):
+    real = [address for row in addresses for address in row if address >= 0]
+    if len(set(real)) != len(real):
+        raise RuntimeError("duplicate blocks")
+    select_vector = [[0] * len(row) for row in addresses]
+    matches = 0
+    for i, row in enumerate(addresses):
+        if block_id in row:
+            j = row.index(block_id)
+            select_vector[i][j] = 1
+            row[j] = -1
+            matches += 1
+    return select_vector, addresses, matches
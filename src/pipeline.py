@@ -0,0 +1,224 @@
+"""A pipelined front end for onion_oram.Client.
+
+AsyncClient accepts accesses from any number of threads and serves them
+from one dispatcher thread. The accesses queued at a time are grouped by
+block: every group costs a single ORAM access, which reads the block once
+and writes back its final contents, while every caller still sees the
+value its own access would have seen in order. While one access runs,
+the path metadata of the next one is fetched from a second thread; the
+metadata the current access writes in the meantime is recorded and
+patched into the prefetched path before it is used."""
+
+import threading
+from onion_oram import Operations
+
+
+class PendingAccess(object):
+    """The result of an access submitted to an AsyncClient."""
+    def __init__(self, block_id, operation, new_chunks):
+        self.block_id = block_id
+        self.operation = operation
+        self.new_chunks = new_chunks
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the access and returns what Client.access() would."""
+        if not self.event.wait(timeout):
+            raise RuntimeError("Timed out waiting for the access.")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def _finish(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.event.set()
+
+
+class _RecordingWrapper(object):
+    """Passes every call through to the server wrapper and, while
+       recording, remembers the address each write leaves in a slot."""
+    def __init__(self, server_wrapper):
+        self.server_wrapper = server_wrapper
+        self.written = None
+
+    def __getattr__(self, name):
+        return getattr(self.server_wrapper, name)
+
+    def set_addresses(self, buckets, addresses):
+        if self.written is not None:
+            for bucket_id, row in zip(buckets, addresses):
+                for block_id, address in enumerate(row):
+                    self.written[(bucket_id, block_id)] = address
+        self.server_wrapper.set_addresses(buckets, addresses)
+
+    def set_block(self, bucket_id, block_id, block):
+        self.set_blocks([(bucket_id, block_id, block)])
+
+    def set_blocks(self, writes):
+        if self.written is not None:
+            for bucket_id, block_id, block in writes:
+                self.written[(bucket_id, block_id)] = block.address
+        self.server_wrapper.set_blocks(writes)
+
+    def invalidate(self, bucket_id, block_id):
+        self.invalidate_blocks([(bucket_id, block_id)])
+
+    def invalidate_blocks(self, slots):
+        if self.written is not None:
+            for bucket_id, block_id in slots:
+                self.written[(bucket_id, block_id)] = -1
+        self.server_wrapper.invalidate_blocks(slots)
+
+
+class _Prefetch(object):
+    def __init__(self, server_wrapper, leaf_target):
+        self.leaf_target = leaf_target
+        self.path = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run,
+                                       args=(server_wrapper,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, server_wrapper):
+        try:
+            self.path = server_wrapper.get_addresses(self.leaf_target)
+        except Exception as e:
+            self.error = e
+
+    def get(self, written):
+        """The prefetched path, with the writes made since applied."""
+        self.thread.join()
+        if self.error is not None:
+            return None
+        bucket_ids, addresses = self.path
+        for i, bucket_id in enumerate(bucket_ids):
+            for j in range(len(addresses[i])):
+                if (bucket_id, j) in written:
+                    addresses[i][j] = written[(bucket_id, j)]
+        return bucket_ids, addresses
+
+
+class AsyncClient(object):
+    def __init__(self, client):
+        """Takes over client: from now on it must only be accessed through
+           this AsyncClient."""
+        self.client = client
+        self.recorder = _RecordingWrapper(client.server_wrapper)
+        client.server_wrapper = self.recorder
+        self.condition = threading.Condition()
+        self.queue = []
+        self.closed = False
+        self.thread = None
+        self.accesses = 0
+
+    def submit(self, block_id, operation, new_chunks=None):
+        """Queues an access and returns its PendingAccess. Accesses queued
+           before start() are served together once it is called."""
+        assert block_id >= 0 and block_id < self.client.total_blocks
+        if operation == Operations.WRITE:
+            new_chunks = list(new_chunks)
+        pending = PendingAccess(block_id, operation, new_chunks)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The client has been stopped.")
+            self.queue.append(pending)
+            self.condition.notify()
+        return pending
+
+    def access(self, block_id, operation, new_chunks=None):
+        return self.submit(block_id, operation, new_chunks).result()
+
+    def start(self):
+        if self.thread is not None:
+            return self
+        self.closed = False
+        self.thread = threading.Thread(target=self._dispatch)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Serves the accesses already queued, then stops."""
+        if self.thread is None:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                while not self.closed and len(self.queue) == 0:
+                    self.condition.wait()
+                if len(self.queue) == 0:
+                    return
+                batch = self.queue
+                self.queue = []
+            self._serve(batch)
+
+    def _serve(self, batch):
+        # group by block in order of first arrival, keeping the order of the
+        # accesses within a group
+        groups = []
+        by_block = {}
+        for pending in batch:
+            if pending.block_id not in by_block:
+                by_block[pending.block_id] = []
+                groups.append(by_block[pending.block_id])
+            by_block[pending.block_id].append(pending)
+
+        prefetch = None
+        for index, group in enumerate(groups):
+            path = None
+            if prefetch is not None:
+                path = prefetch.get(self.recorder.written)
+            self.recorder.written = {}
+            prefetch = None
+            if index + 1 < len(groups):
+                leaf_target = \
+                    self.client.position_map[groups[index + 1][0].block_id]
+                if leaf_target >= 0:
+                    prefetch = _Prefetch(self.recorder.server_wrapper,
+                                         leaf_target)
+            self._serve_group(group, path)
+        if prefetch is not None:
+            prefetch.thread.join()
+        self.recorder.written = None
+
+    def _serve_group(self, group, path):
+        """Serves the accesses to one block with a single ORAM access."""
+        block_id = group[0].block_id
+        unwritten = not self.client.written[block_id]
+        writes = [p for p in group if p.operation == Operations.WRITE]
+        try:
+            if unwritten and len(writes) == 0:
+                raise RuntimeError("Trying to access block not written "
+                                   "before.")
+            new_chunks = writes[-1].new_chunks if len(writes) > 0 else None
+            chunks = self.client._access(block_id, new_chunks, path)
+            self.accesses += 1
+        except Exception as e:
+            for pending in group:
+                pending._finish(error=e)
+            return
+
+        # replay the group against the block's contents
+        for pending in group:
+            if pending.operation == Operations.WRITE:
+                chunks = pending.new_chunks
+                unwritten = False
+                pending._finish()
+            elif unwritten:
+                pending._finish(error=RuntimeError(
+                    "Trying to access block not written before."))
+            else:
+                pending._finish(list(chunks))
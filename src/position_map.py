@@ -0,0 +1,105 @@
+"""Position maps for onion_oram.Client.
+
+A position map holds the leaf target of every block, or -1 for the blocks
+that have not been written yet; the client only indexes it. A plain list
+is the default. PackedPositionMap stores total_levels bits per block in a
+bytearray, and RecursivePositionMap stores the entries in the blocks of a
+smaller ORAM, so that the client keeps only that ORAM's own state."""
+
+from onion_oram import Operations
+
+
+class PackedPositionMap(object):
+    def __init__(self, total_blocks, total_levels):
+        self.total_blocks = total_blocks
+        self.bits = total_levels
+        self.mask = (1 << total_levels) - 1
+        # one spare byte, so that an entry can always be read as a whole
+        # number of bytes
+        self.data = bytearray((total_blocks * self.bits + 7) / 8 + 1)
+        self.valid = bytearray((total_blocks + 7) / 8)
+
+    def __len__(self):
+        return self.total_blocks
+
+    def _bytes(self, block_id):
+        start = block_id * self.bits
+        return start >> 3, (start + self.bits + 7) >> 3, start & 7
+
+    def __getitem__(self, block_id):
+        if not 0 <= block_id < self.total_blocks:
+            raise IndexError("position map index out of range")
+        if not self.valid[block_id >> 3] & (1 << (block_id & 7)):
+            return -1
+        first, last, shift = self._bytes(block_id)
+        word = 0
+        for k in reversed(xrange(first, last)):
+            word = (word << 8) | self.data[k]
+        return (word >> shift) & self.mask
+
+    def __setitem__(self, block_id, leaf_target):
+        if not 0 <= block_id < self.total_blocks:
+            raise IndexError("position map index out of range")
+        if leaf_target < 0:
+            self.valid[block_id >> 3] &= ~(1 << (block_id & 7)) & 0xff
+            return
+        assert leaf_target <= self.mask
+        self.valid[block_id >> 3] |= 1 << (block_id & 7)
+        first, last, shift = self._bytes(block_id)
+        word = 0
+        for k in reversed(xrange(first, last)):
+            word = (word << 8) | self.data[k]
+        word = (word & ~(self.mask << shift)) | (leaf_target << shift)
+        for k in xrange(first, last):
+            self.data[k] = word & 0xff
+            word >>= 8
+
+
+class RecursivePositionMap(object):
+    """Keeps entries_per_block entries in every block of an inner ORAM,
+       client_factory(total_blocks, chunks_per_block), as leaf target + 1
+       so that the zeros of a fresh block read as -1. The inner ORAM may
+       itself use a RecursivePositionMap.
+
+       Reading an entry reads its block, and the block is kept until the
+       entry is written back, which writes the block; any other access
+       reads it again. So every access to the outer ORAM costs the same
+       number of inner accesses, whichever entries it touches."""
+    def __init__(self, total_blocks, client_factory, entries_per_block=16):
+        self.total_blocks = total_blocks
+        self.entries_per_block = entries_per_block
+        inner_blocks = (total_blocks + entries_per_block - 1) / \
+            entries_per_block
+        self.client = client_factory(inner_blocks, entries_per_block)
+        for inner_block in range(inner_blocks):
+            self.client.access(inner_block, Operations.WRITE,
+                               [0] * entries_per_block)
+        # the block read last, until it is written back
+        self.cached_block = None
+        self.cached_entries = None
+
+    def __len__(self):
+        return self.total_blocks
+
+    def _read(self, inner_block):
+        if self.cached_block != inner_block:
+            self.cached_entries = self.client.access(inner_block,
+                                                     Operations.READ)
+            self.cached_block = inner_block
+        return self.cached_entries
+
+    def __getitem__(self, block_id):
+        if not 0 <= block_id < self.total_blocks:
+            raise IndexError("position map index out of range")
+        entries = self._read(block_id / self.entries_per_block)
+        return entries[block_id % self.entries_per_block] - 1
+
+    def __setitem__(self, block_id, leaf_target):
+        if not 0 <= block_id < self.total_blocks:
+            raise IndexError("position map index out of range")
+        inner_block = block_id / self.entries_per_block
+        entries = list(self._read(inner_block))
+        entries[block_id % self.entries_per_block] = max(leaf_target, -1) + 1
+        self.client.access(inner_block, Operations.WRITE, entries)
+        self.cached_block = None
+        self.cached_entries = None
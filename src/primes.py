@@ -1,36 +1,56 @@
+import multiprocessing
 import random
 import sys
-
-def ipow(a, b, n):
-    """calculates (a**b) % n via binary exponentiation, yielding itermediate
-       results as Rabin-Miller requires"""
-    A = a = long(a % n)
-    yield A
-    t = 1L
-    while t <= b:
-        t <<= 1
-
-    # t = 2**k, and t > b
-    t >>= 2
-
-    while t:
-        A = (A * A) % n
-        if t & b:
-            A = (A * a) % n
-        yield A
-        t >>= 1
-
-def rabin_miller_witness(test, possible):
-    """Using Rabin-Miller witness test, will return True if possible is
-       definitely not prime (composite), False if it may be prime."""
-    return 1 not in ipow(test, possible-1, possible)
+import arithmetic
 
 smallprimes = (2,3,5,7,11,13,17,19,23,29,31,37,41,43,
                47,53,59,61,67,71,73,79,83,89,97)
 
+def _sieve(limit):
+    """All primes below limit, by the sieve of Eratosthenes."""
+    composite = bytearray(limit)
+    primes = []
+    for i in xrange(2, limit):
+        if not composite[i]:
+            primes.append(i)
+            composite[i * i::i] = '\x01' * len(xrange(i * i, limit, i))
+    return primes
+
+# the odd primes that candidates are sieved by before any Rabin-Miller round
+SIEVE_PRIMES = _sieve(1 << 16)[1:]
+
 def default_k(bits):
     return max(40, 2 * bits)
 
+def random_candidate_rounds(bits):
+    """Rabin-Miller rounds for a random odd candidate of this many bits,
+       from the table of OpenSSL 1.1.1's BN_prime_checks_for_size(). It
+       asks for more rounds than Handbook of Applied Cryptography table
+       4.4, which gives 3 at 1024 bits and 2 at 2048. Only meant for
+       random candidates; default_k() is for numbers of unknown origin."""
+    for bound, rounds in [(3747, 3), (1345, 4), (476, 5), (400, 6),
+                          (347, 7), (308, 8), (55, 27)]:
+        if bits >= bound:
+            return rounds
+    return 34
+
+def strong_witness(test, possible):
+    """True if test proves the odd number possible composite, by the strong
+       (Miller-Rabin) form of the Rabin-Miller test."""
+    d = possible - 1
+    r = 0
+    while d % 2 == 0:
+        d /= 2
+        r += 1
+    x = arithmetic.powmod(test, d, possible)
+    if x == 1 or x == possible - 1:
+        return False
+    for _ in xrange(r - 1):
+        x = arithmetic.powmod(x, 2, possible)
+        if x == possible - 1:
+            return False
+    return True
+
 def is_probably_prime(possible, k=None):
     if possible == 1:
         return True
@@ -42,22 +62,81 @@ def is_probably_prime(possible, k=None):
         if possible % i == 0:
             return False
     for i in xrange(k):
-        test = random.randrange(2, possible - 1) | 1
-        if rabin_miller_witness(test, possible):
+        test = random.randrange(2, possible - 1)
+        if strong_witness(test, possible):
             return False
     return True
 
+def _sieve_window(start, size):
+    """Marks, among the odd numbers start, start + 2, ..., start + 2 *
+       (size - 1), those with a factor in SIEVE_PRIMES below start."""
+    composite = bytearray(size)
+    for p in SIEVE_PRIMES:
+        if p >= start:
+            break
+        # the first j with start + 2 * j = 0 mod p; (p + 1) / 2 inverts 2
+        j = (-start * ((p + 1) / 2)) % p
+        if j < size:
+            composite[j::p] = '\x01' * len(xrange(j, size, p))
+    return composite
+
 def generate_prime(bits, k=None):
     """Will generate an integer of b bits that is probably prime
-       (after k trials). Reasonably fast on current hardware for
-       values of up to around 512 bits."""
+       (after k trials). From a random odd start, a window of odd
+       candidates is sieved by SIEVE_PRIMES, and only the survivors get
+       Rabin-Miller rounds, random_candidate_rounds(bits) of them unless k
+       is given."""
     assert bits >= 8
 
     if k is None:
-        k = default_k(bits)
+        k = random_candidate_rounds(bits)
+    # a few times the expected gap between primes of this size
+    size = max(64, 2 * bits)
 
     while True:
-        possible = random.randrange(2 ** (bits-1) + 1, 2 ** bits) | 1
-        if is_probably_prime(possible, k):
-            return possible
+        start = random.randrange(2 ** (bits-1) + 1, 2 ** bits) | 1
+        composite = _sieve_window(start, size)
+        for j in xrange(size):
+            possible = start + 2 * j
+            if possible >= 2 ** bits:
+                break
+            if composite[j]:
+                continue
+            if all(not strong_witness(random.randrange(2, possible - 1),
+                                      possible) for _ in xrange(k)):
+                return possible
+
+def _init_worker():
+    # forked workers inherit the parent's random state, so reseed them to
+    # keep their searches independent
+    random.seed()
+
+def _generate_prime_in_worker(bits):
+    return generate_prime(bits)
+
+def generate_distinct_primes(bits, count, processes=None):
+    """count distinct primes of the given size. If processes is given, the
+       searches run concurrently on a pool of that many processes, at least
+       count, and the first count primes found are kept."""
+    found = []
+    if processes is None:
+        while len(found) < count:
+            prime = generate_prime(bits)
+            if prime not in found:
+                found.append(prime)
+        return found
+
+    pool = multiprocessing.Pool(max(processes, count), _init_worker)
+    try:
+        while len(found) < count:
+            for prime in pool.imap_unordered(_generate_prime_in_worker,
+                                             [bits] * max(processes, count)):
+                if prime not in found:
+                    found.append(prime)
+                if len(found) == count:
+                    break
+    finally:
+        pool.terminate()
+        pool.join()
+    return found
 
@@ -0,0 +1,395 @@
+"""Runs the ORAM server in another process, behind a socket.
+
+ServerDaemon exposes a storage server (onion_oram.Server or one of the
+storage engines) over a Unix socket or TCP; RemoteServer is the client
+side proxy, with the same interface, that is passed to a server wrapper:
+
+    EncServerWrapper(..., server=RemoteServer('/tmp/oram.sock'))
+
+Every call is one round trip. Messages are length-prefixed frames: a
+request is an operation code followed by its encoded arguments, a response
+is a status byte followed by the encoded result or an error message.
+Values are tagged; lists of integers (chunks, selectors, addresses) are
+sent as vectors of fixed-width two's complement integers, so that a vector
+of n-bit ciphertexts costs n bits per element plus a small header."""
+
+import argparse
+import os
+import socket
+import SocketServer
+import struct
+import threading
+import damgard_jurik
+import onion_oram
+import storage
+from onion_oram import Block
+
+
+# the operations of the storage interface, in the order of their codes
+OPS = ['geometry', 'get_addresses', 'set_addresses', 'is_dummy', 'dummy_map',
+       'get_metadata', 'get_chunks', 'get_block', 'set_block', 'invalidate',
+       'select_rows', 'get_bucket_addresses', 'get_bucket_metadata',
+       'set_blocks', 'invalidate_blocks']
+
+_FRAME = struct.Struct('<I')
+_INT64 = struct.Struct('<q')
+_COUNT = struct.Struct('<I')
+_WIDTH = struct.Struct('<H')
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+class RemoteError(Exception):
+    pass
+
+
+def _int_bytes(value):
+    """Bytes needed for value in two's complement."""
+    if value < 0:
+        value = ~value
+    return value.bit_length() / 8 + 1
+
+
+def _encode_int(value, width):
+    return storage.encode(value % (1 << (8 * width)), width)
+
+
+def _decode_int(data):
+    value = storage.decode(data)
+    if value >> (8 * len(data) - 1):
+        value -= 1 << (8 * len(data))
+    return value
+
+
+def _is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def encode(value):
+    """Encodes None, bools, integers, strings, lists, tuples and Blocks."""
+    parts = []
+    _encode(value, parts)
+    return ''.join(parts)
+
+
+def _encode(value, parts):
+    if value is None:
+        parts.append('N')
+    elif value is True:
+        parts.append('T')
+    elif value is False:
+        parts.append('F')
+    elif _is_int(value):
+        if -(1 << 63) <= value < (1 << 63):
+            parts.append('i' + _INT64.pack(value))
+        else:
+            width = _int_bytes(value)
+            parts.append('n' + _WIDTH.pack(width) + _encode_int(value, width))
+    elif isinstance(value, str):
+        parts.append('s' + _COUNT.pack(len(value)) + value)
+    elif isinstance(value, (list, tuple)):
+        if len(value) > 0 and all(_is_int(x) for x in value):
+            width = max(_int_bytes(x) for x in value)
+            parts.append('V' + _COUNT.pack(len(value)) + _WIDTH.pack(width))
+            parts.extend(_encode_int(x, width) for x in value)
+        else:
+            parts.append('L' + _COUNT.pack(len(value)))
+            for x in value:
+                _encode(x, parts)
+    elif isinstance(value, Block):
+        parts.append('K')
+        _encode(value.address, parts)
+        _encode(value.bucket_leaf_target, parts)
+        _encode(value.chunks_per_block, parts)
+        _encode(getattr(value, 'chunks', None), parts)
+    else:
+        raise TypeError("Cannot encode " + repr(value) + ".")
+
+
+def decode(data):
+    value, offset = _decode(data, 0)
+    if offset != len(data):
+        raise ValueError("Trailing bytes after the encoded value.")
+    return value
+
+
+def _decode(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == 'N':
+        return None, offset
+    if tag == 'T':
+        return True, offset
+    if tag == 'F':
+        return False, offset
+    if tag == 'i':
+        return _INT64.unpack_from(data, offset)[0], offset + _INT64.size
+    if tag == 'n':
+        width = _WIDTH.unpack_from(data, offset)[0]
+        offset += _WIDTH.size
+        return _decode_int(data[offset:offset + width]), offset + width
+    if tag == 's':
+        length = _COUNT.unpack_from(data, offset)[0]
+        offset += _COUNT.size
+        return data[offset:offset + length], offset + length
+    if tag == 'V':
+        count = _COUNT.unpack_from(data, offset)[0]
+        width = _WIDTH.unpack_from(data, offset + _COUNT.size)[0]
+        offset += _COUNT.size + _WIDTH.size
+        values = [_decode_int(data[offset + i * width:
+                                   offset + (i + 1) * width])
+                  for i in range(count)]
+        return values, offset + count * width
+    if tag == 'L':
+        count = _COUNT.unpack_from(data, offset)[0]
+        offset += _COUNT.size
+        values = []
+        for _ in range(count):
+            value, offset = _decode(data, offset)
+            values.append(value)
+        return values, offset
+    if tag == 'K':
+        address, offset = _decode(data, offset)
+        bucket_leaf_target, offset = _decode(data, offset)
+        chunks_per_block, offset = _decode(data, offset)
+        chunks, offset = _decode(data, offset)
+        return Block(chunks_per_block, address, bucket_leaf_target,
+                     chunks), offset
+    raise ValueError("Unknown tag " + repr(tag) + ".")
+
+
+def _receive_exactly(sock, size):
+    parts = []
+    while size > 0:
+        part = sock.recv(min(size, 1 << 20))
+        if not part:
+            raise EOFError("Connection closed.")
+        parts.append(part)
+        size -= len(part)
+    return ''.join(parts)
+
+
+def send_frame(sock, payload):
+    sock.sendall(_FRAME.pack(len(payload)) + payload)
+    return _FRAME.size + len(payload)
+
+
+def receive_frame(sock):
+    size = _FRAME.unpack(_receive_exactly(sock, _FRAME.size))[0]
+    return _receive_exactly(sock, size)
+
+
+def _connect(address):
+    """A str address is a Unix socket path, a tuple is (host, port)."""
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.connect(address)
+    return sock
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+    def setup(self):
+        if self.server.address_family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        while True:
+            try:
+                request = receive_frame(self.request)
+            except (EOFError, socket.error):
+                return
+            try:
+                result = self.server.daemon.dispatch(ord(request[0]),
+                                                     decode(request[1:]))
+                response = chr(STATUS_OK) + encode(result)
+            except Exception as e:
+                response = chr(STATUS_ERROR) + encode(repr(e))
+            send_frame(self.request, response)
+
+
+class _UnixServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ServerDaemon(object):
+    def __init__(self, server, address, workers=None):
+        """Serves server on address, a Unix socket path or a (host, port)
+           tuple; port 0 picks a free port, see self.address. Calls are
+           applied one at a time. If workers is given, select_rows() runs
+           on a pool of that many processes."""
+        self.server = server
+        self.workers = workers
+        self.lock = threading.Lock()
+        # (n, s) -> (public key, executor) of the clients seen so far
+        self.keys = {}
+        if isinstance(address, str):
+            self.socket_server = _UnixServer(address, _Handler)
+        else:
+            self.socket_server = _TCPServer(address, _Handler)
+        self.socket_server.daemon = self
+        self.address = self.socket_server.server_address
+        self.thread = None
+
+    def dispatch(self, op, args):
+        with self.lock:
+            name = OPS[op]
+            if name == 'geometry':
+                return [self.server.total_levels,
+                        self.server.blocks_per_bucket,
+                        self.server.chunks_per_block]
+            if name == 'select_rows':
+                n, s, plaintext_space, requests = args
+                public_key, executor = self._get_key(n, s)
+                return self.server.select_rows(public_key, plaintext_space,
+                                               requests, executor,
+                                               self.workers)
+            return getattr(self.server, name)(*args)
+
+    def _get_key(self, n, s):
+        if (n, s) not in self.keys:
+            public_key = damgard_jurik.PublicKey(n, s)
+            executor = None
+            if self.workers is not None:
+                executor = onion_oram.create_select_pool(public_key,
+                                                         self.workers)
+            self.keys[(n, s)] = public_key, executor
+        return self.keys[(n, s)]
+
+    def start(self):
+        """Serves from a background thread."""
+        self.thread = threading.Thread(target=self.socket_server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.socket_server.serve_forever()
+
+    def shutdown(self):
+        if self.thread is not None:
+            self.socket_server.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.socket_server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        for _, executor in self.keys.values():
+            if executor is not None:
+                executor.terminate()
+                executor.join()
+        self.keys = {}
+
+
+class RemoteServer(object):
+    """A proxy for the server behind a ServerDaemon. It counts the bytes it
+       has sent and received, including frame headers, and the round
+       trips it has made."""
+    def __init__(self, address):
+        self.sock = _connect(address)
+        self.lock = threading.Lock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.round_trips = 0
+        self.total_levels, self.blocks_per_bucket, self.chunks_per_block = \
+            self._call('geometry')
+
+    def _call(self, name, *args):
+        request = chr(OPS.index(name)) + encode(list(args))
+        with self.lock:
+            self.bytes_sent += send_frame(self.sock, request)
+            response = receive_frame(self.sock)
+            self.bytes_received += _FRAME.size + len(response)
+            self.round_trips += 1
+        result = decode(response[1:])
+        if ord(response[0]) != STATUS_OK:
+            raise RemoteError(result)
+        return result
+
+    def get_addresses(self, target):
+        return tuple(self._call('get_addresses', target))
+
+    def get_bucket_addresses(self, bucket_ids):
+        return self._call('get_bucket_addresses', bucket_ids)
+
+    def set_addresses(self, buckets, addresses):
+        self._call('set_addresses', buckets, addresses)
+
+    def is_dummy(self, bucket_id, block_id):
+        return self._call('is_dummy', bucket_id, block_id)
+
+    def dummy_map(self, bucket_ids):
+        return self._call('dummy_map', bucket_ids)
+
+    def get_metadata(self, bucket_id, block_id):
+        return tuple(self._call('get_metadata', bucket_id, block_id))
+
+    def get_bucket_metadata(self, bucket_ids):
+        return [[None if entry is None else tuple(entry) for entry in row]
+                for row in self._call('get_bucket_metadata', bucket_ids)]
+
+    def get_chunks(self, bucket_id, block_id):
+        return self._call('get_chunks', bucket_id, block_id)
+
+    def get_block(self, bucket_id, block_id):
+        return self._call('get_block', bucket_id, block_id)
+
+    def set_block(self, bucket_id, block_id, block):
+        self._call('set_block', bucket_id, block_id, block)
+
+    def invalidate(self, bucket_id, block_id):
+        self._call('invalidate', bucket_id, block_id)
+
+    def set_blocks(self, writes):
+        self._call('set_blocks', writes)
+
+    def invalidate_blocks(self, slots):
+        self._call('invalidate_blocks', slots)
+
+    def select_rows(self, public_key, plaintext_space, requests,
+                    executor=None, workers=None):
+        # the selection runs next to the data, on the daemon's own workers
+        return self._call('select_rows', public_key.n, public_key.s,
+                          plaintext_space, requests)
+
+    def close(self):
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves an ORAM tree.")
+    parser.add_argument('--unix', help="Unix socket path to listen on")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7400)
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--blocks-per-bucket', type=int, default=40)
+    parser.add_argument('--chunks-per-block', type=int, default=6)
+    parser.add_argument('--file', help="serve a storage.MappedServer file "
+                        "instead of an in-memory tree")
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    if args.file is not None:
+        server = storage.MappedServer.open(args.file)
+    else:
+        server = onion_oram.Server(args.levels, args.blocks_per_bucket,
+                                   args.chunks_per_block)
+    address = args.unix if args.unix is not None else (args.host, args.port)
+    daemon = ServerDaemon(server, address, args.workers)
+    print "Serving on", daemon.address
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""Compact storage engines that can stand in for onion_oram.Server.
+
+ArrayServer keeps every level of the tree in one contiguous buffer of
+fixed-width little-endian chunk slots, next to parallel array columns for
+the metadata, instead of one Bucket and Block object per slot. Blocks are
+only materialized when get_block() is called.
+
+MappedServer keeps the same slots in a memory-mapped file, so the tree
+can be larger than memory and survives restarts."""
+
+import array
+import binascii
+import mmap
+import os
+import struct
+from onion_oram import Block, ServerOperations, onion_layers
+
+
+def ciphertext_bytes(public_key, space):
+    """Bytes needed to store a ciphertext of the given space, that is an
+       integer below n^space."""
+    return (public_key.get_npows(space).bit_length() + 7) / 8
+
+
+def encrypted_layout(public_key, total_levels, root_plain_space,
+                     metadata_codec=None, max_onion_layers=None):
+    """Returns the chunk width of every level (root first) and the width of
+       the metadata ciphertexts written by onion_oram.EncServerWrapper, with
+       metadata_codec and max_onion_layers if they are given."""
+    chunk_bytes = [ciphertext_bytes(public_key, root_plain_space +
+                                    onion_layers((1 << level) - 1,
+                                                 max_onion_layers))
+                   for level in range(total_levels + 1)]
+    if metadata_codec is not None:
+        return chunk_bytes, metadata_codec.ciphertext_bytes
+    return chunk_bytes, ciphertext_bytes(public_key, 2)
+
+
+def encode(value, width):
+    if value < 0 or value >> (8 * width) != 0:
+        raise ValueError(str(value) + " does not fit in " + str(width) +
+                         " bytes.")
+    return binascii.unhexlify('%0*x' % (2 * width, value))[::-1]
+
+
+def decode(data):
+    return int(binascii.hexlify(data[::-1]), 16)
+
+
+# the struct formats of the widths that fit a machine word
+_WORDS = dict((width, struct.Struct('<' + code))
+              for width, code in [(1, 'B'), (2, 'H'), (4, 'I'), (8, 'Q')])
+
+
+def decode_from(buf, offset, width):
+    """decode(buf[offset: offset + width]). Widths of up to a machine word
+       are read straight out of buf; wider values are copied once, since
+       Python 2 has no int.from_bytes."""
+    word = _WORDS.get(width)
+    if word is not None:
+        return word.unpack_from(buf, offset)[0]
+    return decode(buf[offset: offset + width])
+
+
+def encode_into(buf, offset, value, width):
+    """buf[offset: offset + width] = encode(value, width)."""
+    word = _WORDS.get(width)
+    if word is None:
+        buf[offset: offset + width] = encode(value, width)
+    elif value < 0 or value >> (8 * width) != 0:
+        raise ValueError(str(value) + " does not fit in " + str(width) +
+                         " bytes.")
+    else:
+        word.pack_into(buf, offset, value)
+
+
+def bucket_level(bucket_id):
+    return (bucket_id + 1).bit_length() - 1
+
+
+class ArrayServer(ServerOperations):
+    def __init__(self, total_levels, blocks_per_bucket, chunks_per_block,
+                 chunk_bytes=8, metadata_bytes=None):
+        """chunk_bytes is the width of a chunk slot, either one for the
+           whole tree or one per level. Without metadata_bytes, addresses
+           and leaf targets are plain integers kept in the array columns;
+           otherwise they are ciphertexts of that width, the columns only
+           mark which slots hold one and -1 still marks a dummy address."""
+        self.total_levels = total_levels
+        self.blocks_per_bucket = blocks_per_bucket
+        self.chunks_per_block = chunks_per_block
+        if isinstance(chunk_bytes, (int, long)):
+            chunk_bytes = [chunk_bytes] * (total_levels + 1)
+        assert len(chunk_bytes) == total_levels + 1
+        self.chunk_bytes = list(chunk_bytes)
+        self.metadata_bytes = metadata_bytes
+
+        self.chunks = []
+        self.chunk_counts = []
+        self.addresses = []
+        self.leaf_targets = []
+        self.metadata = []
+        for level in range(total_levels + 1):
+            slots = (1 << level) * blocks_per_bucket
+            self.chunks.append(bytearray(slots * chunks_per_block *
+                                         self.chunk_bytes[level]))
+            self.chunk_counts.append(array.array('i', [0]) * slots)
+            # 'l' is the 64-bit signed type on LP64 platforms
+            self.addresses.append(array.array('l', [-1]) * slots)
+            self.leaf_targets.append(array.array('l', [-1]) * slots)
+            if metadata_bytes is not None:
+                self.metadata.append(bytearray(slots * 2 * metadata_bytes))
+
+    def _slot(self, bucket_id, block_id):
+        level = bucket_level(bucket_id)
+        first = (1 << level) - 1
+        return level, (bucket_id - first) * self.blocks_per_bucket + block_id
+
+    def _get_value(self, column, level, index, offset):
+        value = column[level][index]
+        if self.metadata_bytes is None or value < 0:
+            return value
+        start = (2 * index + offset) * self.metadata_bytes
+        return decode(self.metadata[level][start:
+                                           start + self.metadata_bytes])
+
+    def _set_value(self, column, level, index, offset, value):
+        if self.metadata_bytes is None or value < 0:
+            column[level][index] = value
+            return
+        column[level][index] = 0
+        start = (2 * index + offset) * self.metadata_bytes
+        self.metadata[level][start: start + self.metadata_bytes] = \
+            encode(value, self.metadata_bytes)
+
+    def get_bucket_addresses(self, bucket_ids):
+        addresses = []
+        for bucket_id in bucket_ids:
+            level, first = self._slot(bucket_id, 0)
+            if self.metadata_bytes is None:
+                addresses.append(self.addresses[level][
+                    first: first + self.blocks_per_bucket].tolist())
+            else:
+                addresses.append([
+                    self._get_value(self.addresses, level, first + j, 0)
+                    for j in range(self.blocks_per_bucket)])
+        return addresses
+
+    def set_addresses(self, buckets, addresses):
+        for i in range(len(buckets)):
+            level, first = self._slot(buckets[i], 0)
+            for j in range(self.blocks_per_bucket):
+                self._set_value(self.addresses, level, first + j, 0,
+                                addresses[i][j])
+
+    def is_dummy(self, bucket_id, block_id):
+        level, index = self._slot(bucket_id, block_id)
+        return self.addresses[level][index] < 0
+
+    def get_metadata(self, bucket_id, block_id):
+        level, index = self._slot(bucket_id, block_id)
+        return self._get_value(self.addresses, level, index, 0), \
+            self._get_value(self.leaf_targets, level, index, 1)
+
+    def get_chunks(self, bucket_id, block_id):
+        level, index = self._slot(bucket_id, block_id)
+        if self.addresses[level][index] < 0:
+            return None
+        width = self.chunk_bytes[level]
+        start = index * self.chunks_per_block * width
+        buf = self.chunks[level]
+        return [decode(buf[start + c * width: start + (c + 1) * width])
+                for c in range(self.chunk_counts[level][index])]
+
+    def get_block(self, bucket_id, block_id):
+        address, bucket_leaf_target = self.get_metadata(bucket_id, block_id)
+        return Block(self.chunks_per_block, address, bucket_leaf_target,
+                     self.get_chunks(bucket_id, block_id))
+
+    def set_block(self, bucket_id, block_id, block):
+        level, index = self._slot(bucket_id, block_id)
+        self._set_value(self.addresses, level, index, 0, block.address)
+        self._set_value(self.leaf_targets, level, index, 1,
+                        block.bucket_leaf_target)
+        chunks = getattr(block, 'chunks', None) or []
+        if len(chunks) > self.chunks_per_block:
+            raise ValueError("Block has more than chunks_per_block chunks.")
+        width = self.chunk_bytes[level]
+        start = index * self.chunks_per_block * width
+        self.chunks[level][start: start + len(chunks) * width] = \
+            ''.join(encode(x, width) for x in chunks)
+        self.chunk_counts[level][index] = len(chunks)
+
+    def invalidate(self, bucket_id, block_id):
+        level, index = self._slot(bucket_id, block_id)
+        self.addresses[level][index] = -1
+        self.chunk_counts[level][index] = 0
+
+
+class MappedServer(ServerOperations):
+    """Stores the tree in a memory-mapped file laid out in heap order:
+       bucket i lives at a fixed offset, each level's buckets are padded
+       to a multiple of align bytes (a page by default), so a path is read
+       as total_levels + 1 aligned ranges, see path_ranges().
+
+       Every slot starts with a little-endian header (address + 1,
+       bucket_leaf_target + 1, chunk count), so a freshly created, all-zero
+       sparse file holds only dummy blocks. With metadata_bytes the header
+       values only mark which metadata ciphertexts are present and the
+       ciphertexts follow the header; then come the chunk slots."""
+    MAGIC = 'ONIONMAP'
+    VERSION = 1
+    _header = struct.Struct('<8s6I')
+    _slot_header = struct.Struct('<qqi')
+
+    def __init__(self, path, total_levels, blocks_per_bucket,
+                 chunks_per_block, chunk_bytes=8, metadata_bytes=None,
+                 align=mmap.PAGESIZE):
+        """Creates the file at path, or reopens it if it already exists, in
+           which case the geometry has to match."""
+        self.path = path
+        self.total_levels = total_levels
+        self.blocks_per_bucket = blocks_per_bucket
+        self.chunks_per_block = chunks_per_block
+        if isinstance(chunk_bytes, (int, long)):
+            chunk_bytes = [chunk_bytes] * (total_levels + 1)
+        assert len(chunk_bytes) == total_levels + 1
+        self.chunk_bytes = list(chunk_bytes)
+        self.metadata_bytes = metadata_bytes
+        self.align = align
+
+        geometry = self._header.pack(
+            self.MAGIC, self.VERSION, total_levels, blocks_per_bucket,
+            chunks_per_block, metadata_bytes or 0, align) + \
+            struct.pack('<%dI' % len(self.chunk_bytes), *self.chunk_bytes)
+
+        self.slot_bytes = []
+        self.bucket_bytes = []
+        self.level_offsets = []
+        offset = self._round_up(len(geometry))
+        for level in range(total_levels + 1):
+            slot = self._slot_header.size + 2 * (metadata_bytes or 0) + \
+                chunks_per_block * self.chunk_bytes[level]
+            self.slot_bytes.append(slot)
+            self.bucket_bytes.append(self._round_up(slot * blocks_per_bucket))
+            self.level_offsets.append(offset)
+            offset += (1 << level) * self.bucket_bytes[level]
+        self.size = offset
+
+        if os.path.exists(path):
+            self.file = open(path, 'r+b')
+            if self.file.read(len(geometry)) != geometry:
+                self.file.close()
+                raise ValueError("The geometry of " + path +
+                                 " does not match.")
+        else:
+            self.file = open(path, 'w+b')
+            self.file.write(geometry)
+            self.file.truncate(self.size)
+        self.mm = mmap.mmap(self.file.fileno(), self.size)
+
+    @classmethod
+    def open(cls, path):
+        """Reopens an existing file, reading the geometry from its header."""
+        with open(path, 'rb') as f:
+            header = f.read(cls._header.size)
+            magic, version, total_levels, blocks_per_bucket, \
+                chunks_per_block, metadata_bytes, align = \
+                cls._header.unpack(header)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError(path + " is not an ORAM tree file.")
+            chunk_bytes = struct.unpack('<%dI' % (total_levels + 1),
+                                        f.read(4 * (total_levels + 1)))
+        return cls(path, total_levels, blocks_per_bucket, chunks_per_block,
+                   list(chunk_bytes), metadata_bytes or None, align)
+
+    def _round_up(self, size):
+        return (size + self.align - 1) / self.align * self.align
+
+    def bucket_range(self, bucket_id):
+        """(offset, length) of bucket_id in the file."""
+        level = bucket_level(bucket_id)
+        first = (1 << level) - 1
+        return (self.level_offsets[level] +
+                (bucket_id - first) * self.bucket_bytes[level],
+                self.bucket_bytes[level])
+
+    def path_ranges(self, target):
+        """The ranges of the buckets on the path to leaf target, root
+           first, in the order get_addresses() returns them."""
+        bucket_at = target + (1 << self.total_levels) - 1
+        ranges = []
+        for _ in range(self.total_levels + 1):
+            ranges.append(self.bucket_range(bucket_at))
+            bucket_at = (bucket_at - 1) / 2
+        ranges.reverse()
+        return ranges
+
+    def _slot(self, bucket_id, block_id):
+        level = bucket_level(bucket_id)
+        offset, _ = self.bucket_range(bucket_id)
+        return level, offset + block_id * self.slot_bytes[level]
+
+    def _get_value(self, offset, field):
+        value = self._slot_header.unpack_from(self.mm, offset)[field] - 1
+        if self.metadata_bytes is None or value < 0:
+            return value
+        start = offset + self._slot_header.size + field * self.metadata_bytes
+        return decode_from(self.mm, start, self.metadata_bytes)
+
+    def _set_value(self, offset, field, value):
+        marker = value
+        if self.metadata_bytes is not None and value >= 0:
+            start = offset + self._slot_header.size + \
+                field * self.metadata_bytes
+            encode_into(self.mm, start, value, self.metadata_bytes)
+            marker = 0
+        struct.pack_into('<q', self.mm, offset + 8 * field, marker + 1)
+
+    def get_bucket_addresses(self, bucket_ids):
+        addresses = []
+        for bucket_id in bucket_ids:
+            _, offset = self._slot(bucket_id, 0)
+            level = bucket_level(bucket_id)
+            addresses.append([
+                self._get_value(offset + j * self.slot_bytes[level], 0)
+                for j in range(self.blocks_per_bucket)])
+        return addresses
+
+    def set_addresses(self, buckets, addresses):
+        for i in range(len(buckets)):
+            level, offset = self._slot(buckets[i], 0)
+            for j in range(self.blocks_per_bucket):
+                self._set_value(offset + j * self.slot_bytes[level], 0,
+                                addresses[i][j])
+
+    def is_dummy(self, bucket_id, block_id):
+        _, offset = self._slot(bucket_id, block_id)
+        return struct.unpack_from('<q', self.mm, offset)[0] <= 0
+
+    def get_metadata(self, bucket_id, block_id):
+        _, offset = self._slot(bucket_id, block_id)
+        return self._get_value(offset, 0), self._get_value(offset, 1)
+
+    def get_chunks(self, bucket_id, block_id):
+        level, offset = self._slot(bucket_id, block_id)
+        address, _, count = self._slot_header.unpack_from(self.mm, offset)
+        if address <= 0:
+            return None
+        width = self.chunk_bytes[level]
+        start = offset + self._slot_header.size + \
+            2 * (self.metadata_bytes or 0)
+        return [decode_from(self.mm, start + c * width, width)
+                for c in range(count)]
+
+    def get_block(self, bucket_id, block_id):
+        address, bucket_leaf_target = self.get_metadata(bucket_id, block_id)
+        return Block(self.chunks_per_block, address, bucket_leaf_target,
+                     self.get_chunks(bucket_id, block_id))
+
+    def set_block(self, bucket_id, block_id, block):
+        level, offset = self._slot(bucket_id, block_id)
+        chunks = getattr(block, 'chunks', None) or []
+        if len(chunks) > self.chunks_per_block:
+            raise ValueError("Block has more than chunks_per_block chunks.")
+        self._set_value(offset, 0, block.address)
+        self._set_value(offset, 1, block.bucket_leaf_target)
+        struct.pack_into('<i', self.mm, offset + 16, len(chunks))
+        width = self.chunk_bytes[level]
+        start = offset + self._slot_header.size + \
+            2 * (self.metadata_bytes or 0)
+        for c, x in enumerate(chunks):
+            encode_into(self.mm, start + c * width, x, width)
+
+    def invalidate(self, bucket_id, block_id):
+        _, offset = self._slot(bucket_id, block_id)
+        struct.pack_into('<q', self.mm, offset, 0)
+        struct.pack_into('<i', self.mm, offset + 16, 0)
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
@@ -0,0 +1,49 @@
+import unittest
+import random
+import arithmetic
+
+
+class TestArithmetic(unittest.TestCase):
+    def test_powmod(self):
+        for _ in range(20):
+            modulus = random.getrandbits(300) | 1
+            base = random.getrandbits(300) % modulus
+            exponent = random.getrandbits(300)
+            self.assertEqual(arithmetic.powmod(base, exponent, modulus),
+                             pow(base, exponent, modulus))
+
+    def test_invert(self):
+        modulus = 1000000007
+        for _ in range(20):
+            a = random.randint(1, modulus - 1)
+            self.assertEqual((arithmetic.invert(a, modulus) * a) % modulus, 1)
+        self.assertEqual(arithmetic.invert(5, 1), 1)
+
+    def test_gcd(self):
+        self.assertEqual(arithmetic.gcd(12, 18), 6)
+        self.assertEqual(arithmetic.gcd(0, 7), 7)
+        self.assertEqual(arithmetic.gcd(7, 0), 7)
+        self.assertEqual(arithmetic.gcd(2 ** 100 * 3, 2 ** 90 * 5), 2 ** 90)
+
+    def test_multi_powmod(self):
+        modulus = random.getrandbits(256) | 1
+        for terms in [1, 2, 7]:
+            bases = [random.getrandbits(256) % modulus
+                     for _ in range(terms + 1)]
+            exponents = [random.getrandbits(random.randint(1, 300))
+                         for _ in range(terms)] + [0]
+            expected = 1
+            for base, exponent in zip(bases, exponents):
+                expected = (expected * pow(base, exponent, modulus)) % modulus
+            self.assertEqual(arithmetic.multi_powmod(bases, exponents,
+                                                     modulus), expected)
+        self.assertEqual(arithmetic.multi_powmod([3, 5], [0, 0], 7), 1)
+
+    def test_results_are_builtin_integers(self):
+        self.assertTrue(isinstance(arithmetic.to_int(arithmetic.mpz(5)),
+                                   (int, long)))
+        self.assertTrue(isinstance(arithmetic.powmod(3, 5, 7), (int, long)))
+
+
+if __name__ == '__main__':
+    unittest.main()
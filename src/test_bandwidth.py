@@ -0,0 +1,98 @@
+import unittest
+import random
+import damgard_jurik
+import remote
+from bandwidth import MeteredServer, SHARED
+from bandwidth import measure_accesses, plaintext_block_bytes, report
+from onion_oram import NonEncServerWrapper, EncServerWrapper
+from onion_oram import Client, Operations, Server
+
+
+class TestBandwidth(unittest.TestCase):
+    def check_levels(self, metered):
+        self.assertEqual(sum(s for s, _ in metered.levels.values()),
+                         metered.bytes_sent)
+        self.assertEqual(sum(r for _, r in metered.levels.values()),
+                         metered.bytes_received)
+        self.assertEqual(sum(c[1] for c in metered.calls.values()),
+                         metered.bytes_sent)
+        for level in metered.levels:
+            self.assertTrue(level is SHARED or
+                            0 <= level <= metered.total_levels)
+
+    def test_non_encrypted(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 4
+
+        metered = MeteredServer(Server(total_levels, blocks_per_bucket,
+                                       chunks_per_block))
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block, metered)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, 20, server_wrapper)
+        for i in range(total_blocks):
+            client.access(i, Operations.WRITE, range(chunks_per_block))
+        self.check_levels(metered)
+
+        metered.reset()
+        per_access = measure_accesses(
+            client, metered, [(random.randint(0, total_blocks - 1),
+                               Operations.READ) for _ in range(30)])
+        self.assertEqual(len(per_access), 30)
+        self.assertEqual(sum(s for s, _ in per_access), metered.bytes_sent)
+        summary = report(metered, per_access,
+                         plaintext_block_bytes(chunks_per_block,
+                                               chunk_bytes=8))
+        self.assertEqual(summary['accesses'], 30)
+        self.assertGreater(summary['blowup'], 1)
+        self.assertLessEqual(summary['per_access']['min'],
+                             summary['per_access']['mean'])
+
+    def test_encrypted_matches_socket(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        daemon = remote.ServerDaemon(Server(total_levels, blocks_per_bucket,
+                                            chunks_per_block),
+                                     ('127.0.0.1', 0)).start()
+        server = remote.RemoteServer(daemon.address)
+        sent, received = server.bytes_sent, server.bytes_received
+        metered = MeteredServer(server)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=metered)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, 20, server_wrapper)
+
+        for i in range(total_blocks):
+            client.access(i, Operations.WRITE, [i] * chunks_per_block)
+        per_access = measure_accesses(
+            client, metered, [(random.randint(0, total_blocks - 1),
+                               Operations.READ) for _ in range(10)])
+        # the model is exact
+        self.assertEqual(metered.bytes_sent, server.bytes_sent - sent)
+        self.assertEqual(metered.bytes_received,
+                         server.bytes_received - received)
+        self.check_levels(metered)
+
+        summary = report(metered, per_access,
+                         plaintext_block_bytes(chunks_per_block, public,
+                                               root_plain_space),
+                         public, root_plain_space)
+        expansion = [level['chunk_bytes'] for level in summary['expansion']]
+        self.assertEqual(len(expansion), total_levels + 1)
+        self.assertEqual(expansion, sorted(expansion))
+        self.assertGreater(summary['expansion'][0]['expansion'], 1)
+
+        server.close()
+        daemon.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import copy
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_percentile(self):
+        samples = range(1, 101)
+        self.assertEqual(benchmark.percentile(samples, 0.5), 50)
+        self.assertEqual(benchmark.percentile(samples, 0.99), 99)
+        self.assertEqual(benchmark.percentile([3], 0.99), 3)
+
+    def test_run_and_compare(self):
+        sweep = {'wrapper': ['nonenc', 'enc'], 'total_levels': [2],
+                 'blocks_per_bucket': [20], 'chunks_per_block': [2],
+                 'bits': [64, 128], 's': [1]}
+        report = benchmark.run(['access', 'keygen'], sweep, 3, seed=1)
+        # the key parameters are not swept for the plaintext wrapper
+        self.assertEqual([r['benchmark'] for r in report['results']],
+                         ['access'] * 3 + ['keygen'] * 2)
+        for result in report['results']:
+            self.assertEqual(result['samples'], 3)
+            self.assertTrue(result['p50'] <= result['p99'])
+            self.assertGreater(result['peak_rss_kb'], 0)
+
+        rows, regressions = benchmark.compare(report, report)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(regressions, [])
+        slower = copy.deepcopy(report)
+        slower['results'][0]['p50'] *= 2
+        rows, regressions = benchmark.compare(report, slower, 0.5)
+        self.assertEqual(len(regressions), 1)
+
+    def test_peak_rss_per_case(self):
+        def bench_allocate(params, samples):
+            data = bytearray(params['megabytes'] << 20)
+            return [float(len(data) > 0)] * samples
+        benchmark.FUNCTIONS['allocate'] = bench_allocate
+        benchmark.PARAMETERS['allocate'] = ['megabytes']
+        try:
+            report = benchmark.run(['allocate'], {'megabytes': [64, 1]}, 1)
+        finally:
+            del benchmark.FUNCTIONS['allocate']
+            del benchmark.PARAMETERS['allocate']
+        big, small = [r['peak_rss_kb'] for r in report['results']]
+        # the second case does not report the first one's peak
+        self.assertGreater(big - small, 32 << 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
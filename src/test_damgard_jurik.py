@@ -2,7 +2,10 @@ import unittest
 import random
 from damgard_jurik import generate_keypair, encrypt, decrypt, Payload
 from damgard_jurik import homomorphic_add, homomorphic_select
+from damgard_jurik import homomorphic_select_many
 from damgard_jurik import homomorphic_scalar_multiply
+from damgard_jurik import FixedBaseTable, RandomnessPool, modpow
+from damgard_jurik import MASK_SECURITY
 
 
 class TestDamgardJurik(unittest.TestCase):
@@ -27,6 +30,21 @@ class TestDamgardJurik(unittest.TestCase):
             res = homomorphic_select(enc, selector)
             self.assertEqual(res.get_plaintext(private).payload, nums[i])
 
+    def test_homomorphic_select_many(self):
+        base_level = 1
+        public, private = generate_keypair(128, base_level)
+        rows = [[11, 12, 13], [21, 22, 23], [31, 32, 33]]
+        # payloads come from different onion depths, up to 3 layers
+        max_onion_layers = base_level + 3
+        selector = [Payload(x, public, max_onion_layers,
+                            max_onion_layers).lift_once() for x in [0, 1, 0]]
+        payload_rows = [[Payload(x, public, base_level,
+                                 base_level).lift_by(i + 1)
+                         for i, x in enumerate(row)] for row in rows]
+        res = homomorphic_select_many(payload_rows, selector)
+        self.assertEqual([x.get_plaintext(private).payload for x in res],
+                         [12, 22, 32])
+
     def test_homomorphic_scalar_multiply_one(self):
         base_level = 2
         onion_level = 4
@@ -49,6 +67,55 @@ class TestDamgardJurik(unittest.TestCase):
         res = homomorphic_scalar_multiply(hidden, selector)
         self.assertEqual(res.get_plaintext(private).payload, 0)
 
+    def test_fixed_base_table(self):
+        modulus = random.getrandbits(200) | 1
+        base = random.getrandbits(200) % modulus
+        table = FixedBaseTable(base, modulus, 100)
+        for _ in range(10):
+            exponent = random.getrandbits(100)
+            self.assertEqual(table.pow(exponent),
+                             modpow(base, exponent, modulus))
+
+    def test_mask_base(self):
+        public, private = generate_keypair(128, 2)
+        # -h is a square modulo both primes
+        for prime in [private.p, private.q]:
+            self.assertEqual(modpow(-public.mask_base % prime,
+                                    (prime - 1) / 2, prime), 1)
+        self.assertEqual(public.mask_bits, public.bits + MASK_SECURITY)
+        table = public.get_mask_table(2)
+        self.assertGreaterEqual(table.window * len(table.rows),
+                                public.mask_bits)
+
+    def test_g_pow_binomial(self):
+        public, _ = generate_keypair(128, 5)
+        for s in range(1, 6):
+            modulus = public.get_npows(s + 1)
+            for m in [0, 1, 2, random.getrandbits(public.bits * s)]:
+                self.assertEqual(public.get_g_pow(s, m),
+                                 modpow(public.n + 1, m, modulus))
+
+    def test_randomness_pool(self):
+        public, private = generate_keypair(128, 3)
+        pool = RandomnessPool(public, low_watermark=2, high_watermark=4)
+        pool.fill(3)
+        self.assertEqual(pool.available(3), 4)
+        pool.start()
+        try:
+            self.assertTrue(public.pool is pool)
+            for _ in range(10):
+                plaintext = random.randint(0, 100000)
+                ciphertext = encrypt(public, 3, plaintext)
+                self.assertEqual(decrypt(public, private, 3, ciphertext),
+                                 plaintext)
+        finally:
+            pool.stop()
+        self.assertTrue(public.pool is None)
+        # every mask must be an n^s-th residue: it decrypts to zero
+        pool.fill(2, 3)
+        for _ in range(3):
+            self.assertEqual(decrypt(public, private, 2, pool.get(2)), 0)
+
     def test_encrypt_decrypt(self):
         public, private = generate_keypair(128, 8)
         for _ in range(10):
@@ -57,6 +124,16 @@ class TestDamgardJurik(unittest.TestCase):
             deciphered = decrypt(public, private, 8, ciphertext)
             self.assertEqual(deciphered, plaintext)
 
+    def test_decrypt_crt_matches_full_exponent(self):
+        public, private = generate_keypair(128, 4)
+        for s in range(1, 5):
+            ciphertext = encrypt(public, s, random.randint(0, 100000))
+            private.crt = True
+            with_crt = decrypt(public, private, s, ciphertext)
+            private.crt = False
+            without_crt = decrypt(public, private, s, ciphertext)
+            self.assertEqual(with_crt, without_crt)
+
     def test_homomorphic_operation(self):
         public, private = generate_keypair(128, 8)
         e12851 = encrypt(public, 8, 12851)
@@ -0,0 +1,113 @@
+import unittest
+import json
+import random
+import damgard_jurik
+import bandwidth
+import instrumentation
+from onion_oram import NonEncServerWrapper, EncServerWrapper, MetadataCache
+from onion_oram import Client, Operations
+
+
+class TestInstrumentation(unittest.TestCase):
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_damgard_jurik_counters(self):
+        public, private = damgard_jurik.generate_keypair(128, 2)
+        self.assertIsNone(instrumentation.active)
+        recorder = instrumentation.enable()
+        ciphertext = damgard_jurik.encrypt(public, 2, 5)
+        damgard_jurik.encrypt(public, 2, 6)
+        self.assertEqual(damgard_jurik.decrypt(public, private, 2,
+                                               ciphertext), 5)
+        self.assertIs(instrumentation.disable(), recorder)
+        damgard_jurik.encrypt(public, 2, 7)
+        self.assertEqual(recorder.counts[('encrypt', 2)], 2)
+        self.assertEqual(recorder.counts[('decrypt', 2)], 1)
+        self.assertGreater(sum(count for (operation, _), count
+                               in recorder.counts.items()
+                               if operation == 'modpow'), 0)
+
+    def test_server_calls(self):
+        total_levels = 3
+        total_blocks = (1 << total_levels) * 2
+        server_wrapper = NonEncServerWrapper(total_levels, 20, 2)
+        server = server_wrapper.server
+        client = Client(total_levels, total_blocks, 20, 2, 20,
+                        server_wrapper)
+        client.bulk_load((i, [i, i]) for i in range(total_blocks))
+
+        recorder = client.enable_instrumentation(trace=True)
+        metered = server_wrapper.server
+        self.assertIsInstance(metered, bandwidth.MeteredServer)
+        for i in range(5):
+            client.access(i, Operations.READ)
+        results = client.access_many([(i, Operations.READ, None)
+                                      for i in range(5, 9)])
+        self.assertEqual(results, [[i, i] for i in range(5, 9)])
+        client.disable_instrumentation()
+        self.assertIs(server_wrapper.server, server)
+        client.access(0, Operations.READ)
+
+        # the calls are sized as they would be sent over remote.py
+        self.assertEqual(sum(sent for _, sent, _ in recorder.calls.values()),
+                         metered.bytes_sent)
+        self.assertEqual(sum(received for _, _, received
+                             in recorder.calls.values()),
+                         metered.bytes_received)
+        self.assertEqual([entry['block_id'] for entry in recorder.trace[:5]],
+                         range(5))
+        self.assertEqual(sorted(entry['block_id']
+                                for entry in recorder.trace[5:]),
+                         range(5, 9))
+        self.assertEqual([entry['batch'] for entry in recorder.trace],
+                         [1] * 5 + [4] * 4)
+        # one selection per access of the batch
+        self.assertEqual(recorder.trace[5]['calls']['get_chunks'][0], 4)
+
+    def test_client_trace(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 5
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period,
+                        MetadataCache(server_wrapper, total_levels,
+                                      blocks_per_bucket, levels=0))
+        client.bulk_load((i, [i] * chunks_per_block)
+                         for i in range(total_blocks))
+
+        recorder = client.enable_instrumentation(trace=True)
+        for _ in range(eviction_period):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             [piece] * chunks_per_block)
+        client.disable_instrumentation()
+
+        self.assertEqual(len(recorder.trace), eviction_period)
+        self.assertEqual(recorder.evictions, 1)
+        self.assertEqual(recorder.trace[-1]['evictions'], 1)
+        for name in ['metadata', 'scan', 'select', 'set_addresses',
+                     'root_write', 'selector_encryption',
+                     'homomorphic_select', 'chunk_decryption',
+                     'metadata_decryption', 'reencryption']:
+            self.assertEqual(recorder.trace[0]['phases'][name][0], 1)
+        self.assertEqual(recorder.phases['metadata'][0], eviction_period)
+        # one chunk selection per chunk of every access
+        self.assertEqual(sum(recorder.trace[0]['counts'][key]
+                             for key in recorder.trace[0]['counts']
+                             if key[0] == 'select'), chunks_per_block)
+        self.assertGreater(recorder.calls['get_bucket_addresses'][2], 0)
+        self.assertGreater(recorder.calls['select_rows'][1], 0)
+        json.dumps(recorder.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import random
+import damgard_jurik
+import metadata
+import storage
+from onion_oram import EncServerWrapper, Client, Operations
+
+
+class TestMetadataCodec(unittest.TestCase):
+    def check_codec(self, codec, value_bits):
+        for value in [0, 1, (1 << value_bits) - 1] + \
+                [random.getrandbits(value_bits) for _ in range(20)]:
+            ciphertext = codec.encrypt(value)
+            self.assertGreater(ciphertext, 0)
+            self.assertLessEqual((ciphertext.bit_length() + 7) / 8,
+                                 codec.ciphertext_bytes)
+            self.assertEqual(codec.decrypt(ciphertext), value)
+
+    def test_damgard_jurik(self):
+        public, private = damgard_jurik.generate_keypair(128, 1)
+        self.check_codec(metadata.DamgardJurikCodec(public, private), 64)
+
+    def test_hmac(self):
+        codec = metadata.HmacCodec()
+        self.check_codec(codec, 64)
+        self.assertNotEqual(codec.encrypt(5), codec.encrypt(5))
+        self.assertRaises(ValueError, codec.encrypt, 1 << 64)
+        self.assertRaises(ValueError, codec.encrypt, -1)
+        self.check_codec(metadata.HmacCodec(value_bits=300), 300)
+
+        other = metadata.HmacCodec(codec.key)
+        self.assertEqual(other.decrypt(codec.encrypt(12345)), 12345)
+        self.assertNotEqual(
+            metadata.HmacCodec().decrypt(codec.encrypt(12345)), 12345)
+
+    def test_client_with_hmac(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        codec = metadata.HmacCodec()
+        chunk_bytes, metadata_bytes = storage.encrypted_layout(
+            public, total_levels, root_plain_space, codec)
+        self.assertEqual(metadata_bytes, codec.ciphertext_bytes)
+        server = storage.ArrayServer(total_levels, blocks_per_bucket,
+                                     chunks_per_block, chunk_bytes,
+                                     metadata_bytes)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=server,
+                                          metadata_codec=codec)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(15):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import random
+from onion_oram import Block, Client, Operations
+try:
+    import numpy_tier
+except ImportError:
+    numpy_tier = None
+
+
+@unittest.skipIf(numpy_tier is None, "NumPy is not installed")
+class TestNumpyServerWrapper(unittest.TestCase):
+    def test_blocks(self):
+        server_wrapper = numpy_tier.NumpyServerWrapper(3, 4, 5)
+        self.assertTrue(server_wrapper.is_dummy(9, 2))
+        server_wrapper.set_block(9, 2, Block(5, 11, 2, [7, 8, 9, 10, 11]))
+        self.assertFalse(server_wrapper.is_dummy(9, 2))
+        self.assertEqual(server_wrapper.get_metadata(9, 2), (11, 2, 5))
+        block = server_wrapper.get_block(9, 2)
+        self.assertEqual(block.chunks, [7, 8, 9, 10, 11])
+        # bucket 9 is the leaf of the path to leaf 2: 0, 1, 4, 9
+        buckets, addresses = server_wrapper.get_addresses(2)
+        self.assertEqual(buckets, [0, 1, 4, 9])
+        self.assertEqual(addresses.tolist(),
+                         [[-1] * 4] * 3 + [[-1, -1, 11, -1]])
+        self.assertEqual(server_wrapper.select_block(
+            [0, 4, 9], [[0] * 4, [0] * 4, [0, 0, 1, 0]]), [7, 8, 9, 10, 11])
+        server_wrapper.invalidate(9, 2)
+        self.assertTrue(server_wrapper.is_dummy(9, 2))
+
+    def test_stress(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 6
+        eviction_period = 40
+
+        server_wrapper = numpy_tier.NumpyServerWrapper(
+            total_levels, blocks_per_bucket, chunks_per_block)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [range(chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(300):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+            random.shuffle(datas[piece])
+            client.access(piece, Operations.WRITE, datas[piece])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
 import random
+import threading
+import time
 import damgard_jurik
+import onion_oram
 from onion_oram import NonEncServerWrapper, EncServerWrapper
 from onion_oram import Client, Operations
 
@@ -30,6 +33,51 @@ class TestOnionORAM(unittest.TestCase):
         self.assertEqual(client.access(13, Operations.READ), [189, 224])
         self.assertEqual(client.access(1, Operations.READ), chunks)
 
+    def test_check_aliasing(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 4
+        onion_oram.CHECK_ALIASING = True
+        try:
+            server_wrapper = NonEncServerWrapper(total_levels,
+                                                 blocks_per_bucket,
+                                                 chunks_per_block)
+            client = Client(total_levels, total_blocks, blocks_per_bucket,
+                            chunks_per_block, 40, server_wrapper)
+            datas = [range(chunks_per_block) for _ in range(total_blocks)]
+            for i in range(total_blocks):
+                client.access(i, Operations.WRITE, datas[i])
+                # the caller keeps ownership of the list it wrote
+                random.shuffle(datas[i])
+                datas[i] = range(chunks_per_block)
+            for _ in range(100):
+                piece = random.randint(0, total_blocks - 1)
+                chunks = client.access(piece, Operations.READ)
+                self.assertEqual(chunks, datas[piece])
+                chunks.reverse()
+            block = server_wrapper.get_block(0, 0)
+            self.assertRaises(AttributeError, setattr, block, 'address', 7)
+        finally:
+            onion_oram.CHECK_ALIASING = False
+
+    def test_set_dummy_block(self):
+        server_wrapper = NonEncServerWrapper(3, 4, 3)
+        server_wrapper.set_block(9, 1, onion_oram.Block(3, 5, 2, [4, 5, 6]))
+        self.assertFalse(server_wrapper.is_dummy(9, 1))
+        server_wrapper.set_block(9, 1, onion_oram.Block(3))
+        self.assertTrue(server_wrapper.is_dummy(9, 1))
+
+    def test_get_block_encrypted(self):
+        root_plain_space = 1
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(3, 4, 3, root_plain_space,
+                                          public, private)
+        server_wrapper.set_block(9, 1, onion_oram.Block(3, 5, 2, [4, 5, 6]))
+        block = server_wrapper.get_block(9, 1)
+        self.assertEqual((block.address, block.bucket_leaf_target,
+                          block.chunks), (5, 2, [4, 5, 6]))
+
     def test_stress_non_encrypted(self):
         lambda_ = 80
         total_levels = 5
@@ -86,6 +134,32 @@ class TestOnionORAM(unittest.TestCase):
                          [189, 224, 1, 2, 3, 4, 5, 6, 7, 8])
         self.assertEqual(client.access(1, Operations.READ), chunks)
 
+    def test_encrypted_with_workers(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 5
+        eviction_period = 20
+
+        root_plain_space = 1
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, workers=2)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        try:
+            datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                     for _ in range(total_blocks)]
+            for i in range(len(datas)):
+                client.access(i, Operations.WRITE, datas[i])
+            for _ in range(15):
+                piece = random.randint(0, total_blocks - 1)
+                self.assertEqual(client.access(piece, Operations.READ),
+                                 datas[piece])
+        finally:
+            server_wrapper.close()
+
     def test_stress_encrypted(self):
         lambda_ = 20
         total_levels = 3
@@ -117,5 +191,240 @@ class TestOnionORAM(unittest.TestCase):
             client.access(piece, Operations.WRITE, datas[piece])
 
 
+    def test_access_many(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 6
+        eviction_period = 40
+
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        self.assertRaises(RuntimeError, client.access_many,
+                          [(0, Operations.WRITE, [0] * chunks_per_block),
+                           (1, Operations.READ, None)])
+
+        datas = [range(chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+        client.access_many([(i, Operations.WRITE, datas[i])
+                            for i in range(total_blocks)])
+
+        selections = []
+        select_blocks = server_wrapper.select_blocks
+
+        def counting_select_blocks(requests):
+            # eviction moves select from two buckets, accesses from a path
+            selections.extend(bucket_ids for bucket_ids, _ in requests
+                              if len(bucket_ids) == total_levels + 1)
+            return select_blocks(requests)
+        server_wrapper.select_blocks = counting_select_blocks
+        for _ in range(20):
+            requests = []
+            expected = []
+            for _ in range(random.randint(1, 20)):
+                piece = random.randint(0, 7)
+                if random.randint(0, 1) == 0:
+                    requests.append((piece, Operations.READ, None))
+                    expected.append(list(datas[piece]))
+                else:
+                    datas[piece] = list(datas[piece])
+                    random.shuffle(datas[piece])
+                    requests.append((piece, Operations.WRITE, datas[piece]))
+                    expected.append(None)
+            del selections[:]
+            self.assertEqual(client.access_many(requests), expected)
+            # repeated blocks are padded, so every request costs a path
+            self.assertEqual(len(selections), len(requests))
+        for i in range(total_blocks):
+            self.assertEqual(client.access(i, Operations.READ), datas[i])
+
+    def test_access_many_encrypted(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        client.access_many([(i, Operations.WRITE, datas[i])
+                            for i in range(total_blocks)])
+        pieces = [random.randint(0, total_blocks - 1) for _ in range(10)]
+        self.assertEqual(client.access_many([(piece, Operations.READ, None)
+                                             for piece in pieces]),
+                         [datas[piece] for piece in pieces])
+
+    def test_metadata_cache(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        self.assertEqual(onion_oram.MetadataCache.levels_for_budget(
+            total_levels, blocks_per_bucket, 0), 0)
+        self.assertEqual(onion_oram.MetadataCache.levels_for_budget(
+            total_levels, blocks_per_bucket, 3 * 20 * 32), 2)
+        self.assertEqual(onion_oram.MetadataCache.levels_for_budget(
+            total_levels, blocks_per_bucket, 10 ** 9), total_levels + 1)
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private)
+        cache = onion_oram.MetadataCache(
+            server_wrapper, total_levels, blocks_per_bucket,
+            memory_budget=3 * blocks_per_bucket * 32)
+        self.assertEqual(cache.levels, 2)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, cache)
+
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(15):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+        self.assertEqual(sorted(cache.rows.keys()), [0, 1, 2])
+        for bucket_id, row in cache.rows.items():
+            self.assertEqual(
+                row, server_wrapper.get_bucket_addresses([bucket_id])[0])
+        # half of every path comes from the cache, except for the first
+        # loads of the three cached buckets
+        self.assertEqual(cache.hits + 2 * 3, cache.misses)
+
+    def test_metadata_cache_concurrent_fill(self):
+        fetched = threading.Event()
+        release = threading.Event()
+
+        class PausingWrapper(NonEncServerWrapper):
+            # pauses a read between the server and the cache
+            def get_bucket_addresses(self, bucket_ids):
+                addresses = NonEncServerWrapper.get_bucket_addresses(
+                    self, bucket_ids)
+                fetched.set()
+                release.wait(5)
+                return addresses
+
+        server_wrapper = PausingWrapper(2, 4, 1)
+        cache = onion_oram.MetadataCache(server_wrapper, 2, 4, levels=3)
+        reader = threading.Thread(target=cache.get_bucket_addresses,
+                                  args=([5],))
+        reader.start()
+        fetched.wait(5)
+        # a write to the bucket while its old row is on its way to the
+        # cache must not be lost
+        writer = threading.Thread(target=cache.set_addresses,
+                                  args=([5], [[7, -1, -1, -1]]))
+        writer.start()
+        time.sleep(0.05)
+        release.set()
+        reader.join()
+        writer.join()
+        self.assertEqual(cache.rows[5], [7, -1, -1, -1])
+        self.assertEqual(cache.get_bucket_addresses([5]),
+                         server_wrapper.server.get_bucket_addresses([5]))
+
+    def test_bulk_load(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 20
+        chunks_per_block = 6
+        eviction_period = 40
+
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        self.assertEqual(client.bulk_load(
+            (i, datas[i]) for i in range(total_blocks)), total_blocks)
+        self.assertTrue(all(server_wrapper.is_dummy(0, j)
+                            for j in range(blocks_per_bucket)))
+        self.assertRaises(RuntimeError, client.bulk_load, [(0, datas[0])])
+        for _ in range(200):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+            random.shuffle(datas[piece])
+            client.access(piece, Operations.WRITE, datas[piece])
+
+        full = Client(1, 10, 2, chunks_per_block, eviction_period,
+                      NonEncServerWrapper(1, 2, chunks_per_block))
+        self.assertRaises(RuntimeError, full.bulk_load,
+                          [(i, datas[i]) for i in range(10)])
+        self.assertEqual(full.position_map, [-1] * 10)
+        self.assertEqual(full.written_blocks, [])
+
+    def test_bulk_load_then_evict(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 4
+        chunks_per_block = 2
+        eviction_period = 40
+
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        datas = [[i, random.randint(0, 1000)] for i in range(total_blocks)]
+        client.bulk_load(enumerate(datas))
+        reserve = blocks_per_bucket / 4
+        for bucket_id in range(1, (1 << (total_levels + 1)) - 1):
+            self.assertGreaterEqual(
+                sum(server_wrapper.is_dummy(bucket_id, j)
+                    for j in range(blocks_per_bucket)), reserve)
+
+        evictions = []
+        evict = client._evict_along_path
+
+        def counting_evict(leaf_target):
+            evictions.append(leaf_target)
+            evict(leaf_target)
+        client._evict_along_path = counting_evict
+        # every path is evicted a few times
+        while len(evictions) < 4 << total_levels:
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+
+    def test_bulk_load_encrypted(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, workers=2)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        client.bulk_load(enumerate(datas))
+        for _ in range(10):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+        server_wrapper.close()
+
+
 if __name__ == '__main__':
     unittest.main()
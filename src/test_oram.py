@@ -27,6 +27,25 @@ class TestORAM(unittest.TestCase):
             self.assertEqual("second_string",
                              client.access(2, oram.Operations.READ))
 
+    def test_check_aliasing(self):
+        oram.CHECK_ALIASING = True
+        try:
+            server = oram.Server(5, 16)
+            client = oram.Client(5, 16, 5, server)
+            for i in range(20):
+                client.access(i, oram.Operations.WRITE, str(i))
+            for i in range(20):
+                self.assertEqual(str(i),
+                                 client.access(i, oram.Operations.READ))
+            server.traverse()
+            block = server.get_block(0, 0)
+            self.assertRaises(AttributeError, block.invalidate)
+            bucket = server.get_bucket(0)
+            bucket.invalidate_all()
+            self.assertFalse(server.get_block(0, 0) is bucket.blocks[0])
+        finally:
+            oram.CHECK_ALIASING = False
+
     def test_dynamic_string(self):
         block_len = 8
         total_levels = 7
@@ -0,0 +1,48 @@
+import unittest
+import random
+import path_scan
+from path_scan import scan_path
+
+
+class TestPathScan(unittest.TestCase):
+    def random_path(self, levels, blocks_per_bucket):
+        addresses = random.sample(range(1000), levels * blocks_per_bucket)
+        return [[address if random.randint(0, 2) > 0 else -1
+                 for address in addresses[i * blocks_per_bucket:
+                                          (i + 1) * blocks_per_bucket]]
+                for i in range(levels)]
+
+    def check_scan(self, to_rows):
+        for _ in range(50):
+            addresses = self.random_path(5, 8)
+            i, j = random.randint(0, 4), random.randint(0, 7)
+            addresses[i][j] = 5000
+            expected = [list(row) for row in addresses]
+            expected[i][j] = -1
+            select_vector, rows, matches = scan_path(to_rows(addresses),
+                                                     5000)
+            self.assertEqual(matches, 1)
+            self.assertEqual([list(row) for row in rows], expected)
+            self.assertEqual(sum(map(sum, select_vector)), 1)
+            self.assertEqual(select_vector[i][j], 1)
+
+        self.assertEqual(scan_path(to_rows([[1, -1], [-1, -1]]), 7)[2], 0)
+        self.assertRaises(RuntimeError, scan_path,
+                          to_rows([[1, -1], [-1, 1]]), 1)
+
+    def test_lists(self):
+        self.check_scan(lambda addresses: addresses)
+
+    @unittest.skipIf(path_scan.numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        numpy = path_scan.numpy
+        self.check_scan(lambda addresses: numpy.array(addresses,
+                                                      dtype=numpy.int64))
+        rows = numpy.array([[3, -1], [-1, 4]], dtype=numpy.int64)
+        select_vector, addresses, _ = scan_path(rows, 4)
+        self.assertTrue(addresses is rows)
+        self.assertEqual(select_vector.tolist(), [[0, 0], [0, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
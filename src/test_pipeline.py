@@ -0,0 +1,114 @@
+import unittest
+import random
+import threading
+import damgard_jurik
+from onion_oram import NonEncServerWrapper, EncServerWrapper
+from onion_oram import Client, Operations
+from pipeline import AsyncClient
+
+
+class TestAsyncClient(unittest.TestCase):
+    def test_coalescing(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 4
+        eviction_period = 20
+
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block)
+        client = AsyncClient(Client(total_levels, total_blocks,
+                                    blocks_per_bucket, chunks_per_block,
+                                    eviction_period, server_wrapper))
+        # queued before start(), so they are served as one batch
+        missing = client.submit(1, Operations.READ)
+        pendings = [client.submit(1, Operations.WRITE, [1, 2, 3, 4]),
+                    client.submit(2, Operations.WRITE, [5, 6, 7, 8]),
+                    client.submit(1, Operations.READ),
+                    client.submit(1, Operations.WRITE, [9, 9, 9, 9]),
+                    client.submit(1, Operations.READ),
+                    client.submit(2, Operations.READ)]
+        client.start()
+        self.assertRaises(RuntimeError, missing.result)
+        self.assertEqual([p.result() for p in pendings],
+                         [None, None, [1, 2, 3, 4], None, [9, 9, 9, 9],
+                          [5, 6, 7, 8]])
+        self.assertEqual(client.accesses, 2)
+        self.assertEqual(client.access(1, Operations.READ), [9, 9, 9, 9])
+        client.stop()
+        self.assertRaises(RuntimeError, client.submit, 1, Operations.READ)
+
+    def test_concurrent_non_encrypted(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 6
+        eviction_period = 40
+
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block)
+        client = AsyncClient(Client(total_levels, total_blocks,
+                                    blocks_per_bucket, chunks_per_block,
+                                    eviction_period, server_wrapper)).start()
+        datas = [range(chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+            client.access(i, Operations.WRITE, datas[i])
+
+        # every thread owns a disjoint set of blocks, so it knows what to read
+        errors = []
+
+        def worker(blocks):
+            try:
+                for _ in range(50):
+                    piece = random.choice(blocks)
+                    self.assertEqual(client.access(piece, Operations.READ),
+                                     datas[piece])
+                    random.shuffle(datas[piece])
+                    client.access(piece, Operations.WRITE, datas[piece])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker,
+                                    args=(range(k, total_blocks, 4),))
+                   for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client.stop()
+        self.assertEqual(errors, [])
+        for i in range(total_blocks):
+            self.assertEqual(client.client.access(i, Operations.READ),
+                             datas[i])
+
+    def test_encrypted(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private)
+        client = AsyncClient(Client(total_levels, total_blocks,
+                                    blocks_per_bucket, chunks_per_block,
+                                    eviction_period, server_wrapper))
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        writes = [client.submit(i, Operations.WRITE, datas[i])
+                  for i in range(total_blocks)]
+        client.start()
+        for pending in writes:
+            pending.result()
+        pieces = [random.randint(0, total_blocks - 1) for _ in range(15)]
+        reads = [client.submit(piece, Operations.READ) for piece in pieces]
+        for piece, pending in zip(pieces, reads):
+            self.assertEqual(pending.result(), datas[piece])
+        client.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import random
+from onion_oram import NonEncServerWrapper, Client, Operations
+from position_map import PackedPositionMap, RecursivePositionMap
+
+
+def non_encrypted_client(total_levels, total_blocks, chunks_per_block,
+                         position_map=None):
+    blocks_per_bucket = 40
+    server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                         chunks_per_block)
+    return Client(total_levels, total_blocks, blocks_per_bucket,
+                  chunks_per_block, 40, server_wrapper,
+                  position_map=position_map)
+
+
+class TestPositionMap(unittest.TestCase):
+    def check_map(self, position_map, total_blocks, total_levels):
+        model = [-1] * total_blocks
+        self.assertEqual(len(position_map), total_blocks)
+        for _ in range(500):
+            block_id = random.randint(0, total_blocks - 1)
+            leaf_target = random.randint(-1, (1 << total_levels) - 1)
+            position_map[block_id] = leaf_target
+            model[block_id] = leaf_target
+            block_id = random.randint(0, total_blocks - 1)
+            self.assertEqual(position_map[block_id], model[block_id])
+        self.assertEqual([position_map[i] for i in range(total_blocks)],
+                         model)
+        self.assertRaises(IndexError, position_map.__getitem__,
+                          total_blocks)
+
+    def test_packed(self):
+        for total_levels in [0, 1, 5, 8, 20, 33]:
+            self.check_map(PackedPositionMap(37, total_levels), 37,
+                           total_levels)
+        self.assertEqual(len(PackedPositionMap(1000, 20).data),
+                         1000 * 20 / 8 + 1)
+
+    def test_recursive(self):
+        def factory(total_blocks, chunks_per_block):
+            return non_encrypted_client(3, total_blocks, chunks_per_block)
+        self.check_map(RecursivePositionMap(40, factory, 8), 40, 5)
+
+    def check_client(self, client):
+        total_blocks = client.total_blocks
+        datas = [range(client.chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(100):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+            random.shuffle(datas[piece])
+            client.access(piece, Operations.WRITE, datas[piece])
+
+    def test_client_packed(self):
+        self.check_client(non_encrypted_client(
+            4, 32, 6, PackedPositionMap(32, 4)))
+
+    def test_client_recursive(self):
+        # the inner ORAM keeps its own map in a PackedPositionMap
+        def factory(total_blocks, chunks_per_block):
+            return non_encrypted_client(
+                2, total_blocks, chunks_per_block,
+                PackedPositionMap(total_blocks, 2))
+        self.check_client(non_encrypted_client(
+            4, 32, 6, RecursivePositionMap(32, factory, 4)))
+
+    def test_access_many_recursive(self):
+        def factory(total_blocks, chunks_per_block):
+            return non_encrypted_client(2, total_blocks, chunks_per_block)
+        position_map = RecursivePositionMap(64, factory, 16)
+        client = non_encrypted_client(4, 64, 2, position_map)
+        client.access_many([(i, Operations.WRITE, [i, i])
+                            for i in range(64)])
+
+        inner_accesses = [0]
+        inner_access = position_map.client.access
+
+        def counting_access(*args):
+            inner_accesses[0] += 1
+            return inner_access(*args)
+        position_map.client.access = counting_access
+        # a read and a write of the entry of every block accessed, whether
+        # the blocks share an inner block, repeat, or are padding
+        for block_ids in [[0, 1], [0, 40], [5, 5], [63, 62], [7, 7, 7, 7]]:
+            inner_accesses[0] = 0
+            results = client.access_many([(i, Operations.READ, None)
+                                          for i in block_ids])
+            self.assertEqual(results, [[i, i] for i in block_ids])
+            self.assertEqual(inner_accesses[0], 2 * len(block_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
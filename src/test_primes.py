@@ -0,0 +1,40 @@
+import unittest
+import primes
+
+
+class TestPrimes(unittest.TestCase):
+    def test_is_probably_prime(self):
+        sieved = set(primes.SIEVE_PRIMES[:200])
+        for n in range(3, primes.SIEVE_PRIMES[199] + 1, 2):
+            self.assertEqual(primes.is_probably_prime(n), n in sieved)
+        # Carmichael numbers and a product of two large primes
+        for n in [561, 41041, 825265, 2 ** 61 - 1, (2 ** 61 - 1) * 1000003]:
+            self.assertEqual(primes.is_probably_prime(n), n == 2 ** 61 - 1)
+
+    def test_rounds(self):
+        self.assertEqual(primes.random_candidate_rounds(8), 34)
+        self.assertEqual(primes.random_candidate_rounds(512), 5)
+        self.assertEqual(primes.random_candidate_rounds(1024), 5)
+        self.assertEqual(primes.random_candidate_rounds(2048), 4)
+        rounds = [primes.random_candidate_rounds(bits)
+                  for bits in range(8, 5000)]
+        self.assertEqual(rounds, sorted(rounds, reverse=True))
+
+    def test_generate_prime(self):
+        for bits in [8, 9, 16, 64, 200]:
+            for _ in range(20):
+                p = primes.generate_prime(bits)
+                self.assertEqual(p.bit_length(), bits)
+                self.assertTrue(primes.is_probably_prime(p))
+
+    def test_generate_distinct_primes(self):
+        for processes in [None, 2]:
+            found = primes.generate_distinct_primes(8, 2, processes)
+            self.assertEqual(len(set(found)), 2)
+            for p in found:
+                self.assertEqual(p.bit_length(), 8)
+                self.assertTrue(primes.is_probably_prime(p))
+
+
+if __name__ == '__main__':
+    unittest.main()
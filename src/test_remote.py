@@ -0,0 +1,143 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+import damgard_jurik
+import metadata
+import remote
+from onion_oram import NonEncServerWrapper, EncServerWrapper
+from onion_oram import Block, Client, Operations, Server
+
+
+class TestRemote(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_encode_decode(self):
+        values = [None, True, False, 0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 200,
+                  -2 ** 130, 'abc', [], [1, -1, 2 ** 100],
+                  [[3, 4], [5, 6], [None, 'x']]]
+        for value in values:
+            self.assertEqual(remote.decode(remote.encode(value)),
+                             list(value) if isinstance(value, tuple)
+                             else value)
+        block = remote.decode(remote.encode(Block(3, 7, 2, [1, 2 ** 90, 3])))
+        self.assertEqual((block.address, block.bucket_leaf_target,
+                          block.chunks_per_block, block.chunks),
+                         (7, 2, 3, [1, 2 ** 90, 3]))
+        self.assertTrue(remote.decode(remote.encode(Block(3))).is_dummy())
+        # a vector costs its element width per element
+        self.assertEqual(len(remote.encode([2 ** 1000] * 10)),
+                         1 + 4 + 2 + 10 * 126)
+
+    def test_non_encrypted_unix_socket(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 6
+        eviction_period = 40
+
+        path = os.path.join(self.directory, 'oram.sock')
+        daemon = remote.ServerDaemon(Server(total_levels, blocks_per_bucket,
+                                            chunks_per_block), path).start()
+        server = remote.RemoteServer(path)
+        self.assertEqual(server.blocks_per_bucket, blocks_per_bucket)
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block, server)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [range(chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(100):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+            random.shuffle(datas[piece])
+            client.access(piece, Operations.WRITE, datas[piece])
+        self.assertGreater(server.round_trips, 0)
+        self.assertRaises(remote.RemoteError, server.get_chunks, 10 ** 6, 0)
+
+        server.close()
+        daemon.shutdown()
+        self.assertFalse(os.path.exists(path))
+
+    def test_encrypted_loopback(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        daemon = remote.ServerDaemon(Server(total_levels, blocks_per_bucket,
+                                            chunks_per_block),
+                                     ('127.0.0.1', 0)).start()
+        server = remote.RemoteServer(daemon.address)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=server)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(15):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+        self.assertGreater(server.bytes_sent, 0)
+        self.assertGreater(server.bytes_received, 0)
+
+        server.close()
+        daemon.shutdown()
+
+    def test_eviction_round_trips(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 2
+        eviction_period = 20
+
+        public, private = damgard_jurik.generate_keypair(128, 1)
+        daemon = remote.ServerDaemon(Server(total_levels, blocks_per_bucket,
+                                            chunks_per_block),
+                                     ('127.0.0.1', 0)).start()
+        server = remote.RemoteServer(daemon.address)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, 1, public,
+                                          private, server=server,
+                                          metadata_codec=metadata.HmacCodec())
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        for i in range(total_blocks):
+            client.access(i, Operations.WRITE, [i] * chunks_per_block)
+
+        buckets = range(7)
+        self.assertEqual(server.get_bucket_metadata(buckets),
+                         daemon.server.get_bucket_metadata(buckets))
+        # the plan reads the path with two calls, then every wave selects,
+        # writes and invalidates with one call each
+        before = server.round_trips
+        client._evict_along_path(0)
+        self.assertLessEqual(server.round_trips - before,
+                             2 + 4 * total_levels)
+        for i in range(total_blocks):
+            self.assertEqual(client.access(i, Operations.READ),
+                             [i] * chunks_per_block)
+
+        server.close()
+        daemon.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+import damgard_jurik
+import storage
+from onion_oram import NonEncServerWrapper, EncServerWrapper
+from onion_oram import Block, Client, Operations
+
+
+class TestArrayServer(unittest.TestCase):
+    def test_encode_decode(self):
+        for width in [1, 8, 33]:
+            value = random.getrandbits(8 * width)
+            data = storage.encode(value, width)
+            self.assertEqual(len(data), width)
+            self.assertEqual(storage.decode(bytearray(data)), value)
+        self.assertRaises(ValueError, storage.encode, 256, 1)
+        buf = bytearray(48)
+        for width in [1, 7, 8, 33]:
+            value = random.getrandbits(8 * width)
+            storage.encode_into(buf, 3, value, width)
+            self.assertEqual(buf[3: 3 + width],
+                             bytearray(storage.encode(value, width)))
+            self.assertEqual(storage.decode_from(buf, 3, width), value)
+            self.assertRaises(ValueError, storage.encode_into, buf, 3,
+                              1 << (8 * width), width)
+
+    def test_block_round_trip(self):
+        server = storage.ArrayServer(3, 4, 5, chunk_bytes=[2, 3, 4, 5],
+                                     metadata_bytes=20)
+        self.assertTrue(server.is_dummy(9, 2))
+        server.set_block(9, 2, Block(5, 2 ** 150, 2 ** 100, [7, 8, 2 ** 39]))
+        self.assertFalse(server.is_dummy(9, 2))
+        block = server.get_block(9, 2)
+        self.assertEqual(block.address, 2 ** 150)
+        self.assertEqual(block.bucket_leaf_target, 2 ** 100)
+        self.assertEqual(block.chunks, [7, 8, 2 ** 39])
+        server.invalidate(9, 2)
+        self.assertTrue(server.is_dummy(9, 2))
+        self.assertEqual(server.get_addresses(2)[1][3], [-1] * 4)
+
+    def test_stress_non_encrypted(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 6
+        eviction_period = 40
+
+        server = storage.ArrayServer(total_levels, blocks_per_bucket,
+                                     chunks_per_block)
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block, server)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [range(chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(300):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+            random.shuffle(datas[piece])
+            client.access(piece, Operations.WRITE, datas[piece])
+
+    def test_encrypted(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        chunk_bytes, metadata_bytes = storage.encrypted_layout(
+            public, total_levels, root_plain_space)
+        server = storage.ArrayServer(total_levels, blocks_per_bucket,
+                                     chunks_per_block, chunk_bytes,
+                                     metadata_bytes)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=server)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(15):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+
+    def test_encrypted_max_onion_layers(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 2
+        eviction_period = 40
+        max_onion_layers = 2
+
+        root_plain_space = 1
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        chunk_bytes, metadata_bytes = storage.encrypted_layout(
+            public, total_levels, root_plain_space,
+            max_onion_layers=max_onion_layers)
+        # every level from the cap down stores the same width
+        self.assertEqual(len(set(chunk_bytes[max_onion_layers - 1:])), 1)
+        self.assertLess(chunk_bytes[-1], storage.encrypted_layout(
+            public, total_levels, root_plain_space)[0][-1])
+        # the deeper slots are too narrow for uncapped chunks
+        server = storage.ArrayServer(total_levels, blocks_per_bucket,
+                                     chunks_per_block, chunk_bytes,
+                                     metadata_bytes)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=server,
+                                          max_onion_layers=max_onion_layers)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(30):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+
+
+class TestMappedServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tree.oram')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_layout(self):
+        server = storage.MappedServer(self.path, 3, 4, 5)
+        ranges = server.path_ranges(5)
+        self.assertEqual(len(ranges), 4)
+        for offset, length in ranges:
+            self.assertEqual(offset % server.align, 0)
+            self.assertEqual(length % server.align, 0)
+        self.assertEqual(ranges[0], server.bucket_range(0))
+        self.assertEqual(ranges[-1], server.bucket_range(5 + 7))
+        self.assertEqual(server.get_addresses(5)[0], [0, 2, 5, 12])
+        self.assertTrue(all(server.is_dummy(b, j)
+                            for b in range(15) for j in range(4)))
+        server.close()
+
+    def test_persists_across_reopen(self):
+        server = storage.MappedServer(self.path, 3, 4, 5, [2, 3, 4, 5],
+                                      metadata_bytes=20, align=64)
+        server.set_block(9, 2, Block(5, 2 ** 150, 2 ** 100, [7, 8, 2 ** 39]))
+        server.set_addresses([0], [[-1, 3, -1, 2 ** 70]])
+        server.close()
+
+        self.assertRaises(ValueError, storage.MappedServer, self.path,
+                          3, 4, 6)
+        server = storage.MappedServer.open(self.path)
+        self.assertEqual(server.align, 64)
+        block = server.get_block(9, 2)
+        self.assertEqual(block.address, 2 ** 150)
+        self.assertEqual(block.bucket_leaf_target, 2 ** 100)
+        self.assertEqual(block.chunks, [7, 8, 2 ** 39])
+        self.assertEqual(server.get_addresses(0)[1][0], [-1, 3, -1, 2 ** 70])
+        server.invalidate(9, 2)
+        self.assertTrue(server.is_dummy(9, 2))
+        server.close()
+
+    def test_client_non_encrypted(self):
+        total_levels = 4
+        blocks_per_bucket = 40
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 6
+        eviction_period = 40
+
+        server = storage.MappedServer(self.path, total_levels,
+                                      blocks_per_bucket, chunks_per_block)
+        server_wrapper = NonEncServerWrapper(total_levels, blocks_per_bucket,
+                                             chunks_per_block, server)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        datas = [range(chunks_per_block) for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            random.shuffle(datas[i])
+            client.access(i, Operations.WRITE, datas[i])
+        for _ in range(100):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+        server.close()
+
+    def test_client_encrypted_reopen(self):
+        total_levels = 3
+        blocks_per_bucket = 20
+        total_blocks = (1 << total_levels) * 2
+        chunks_per_block = 3
+        eviction_period = 20
+
+        root_plain_space = 2
+        public, private = damgard_jurik.generate_keypair(128, root_plain_space)
+        chunk_bytes, metadata_bytes = storage.encrypted_layout(
+            public, total_levels, root_plain_space)
+        server = storage.MappedServer(self.path, total_levels,
+                                      blocks_per_bucket, chunks_per_block,
+                                      chunk_bytes, metadata_bytes)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=server)
+        client = Client(total_levels, total_blocks, blocks_per_bucket,
+                        chunks_per_block, eviction_period, server_wrapper)
+        datas = [[random.randint(0, 1000) for _ in range(chunks_per_block)]
+                 for _ in range(total_blocks)]
+        for i in range(len(datas)):
+            client.access(i, Operations.WRITE, datas[i])
+
+        def stored_blocks(wrapper):
+            blocks = {}
+            for b in range((1 << (total_levels + 1)) - 1):
+                for j in range(blocks_per_bucket):
+                    if not wrapper.is_dummy(b, j):
+                        block = wrapper.get_block(b, j)
+                        blocks[(b, j)] = (block.address,
+                                          block.bucket_leaf_target,
+                                          block.chunks)
+            return blocks
+        before = stored_blocks(server_wrapper)
+        self.assertGreater(len(before), 0)
+        server.close()
+
+        server = storage.MappedServer.open(self.path)
+        server_wrapper = EncServerWrapper(total_levels, blocks_per_bucket,
+                                          chunks_per_block, root_plain_space,
+                                          public, private, server=server)
+        self.assertEqual(stored_blocks(server_wrapper), before)
+        client.server_wrapper = server_wrapper
+        for _ in range(15):
+            piece = random.randint(0, total_blocks - 1)
+            self.assertEqual(client.access(piece, Operations.READ),
+                             datas[piece])
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()